@@ -1,6 +1,7 @@
 import random
 import struct
-from sha256 import SHA256
+from functools import lru_cache
+from sha256 import PySHA256
 from toyecc import AffineCurvePoint, getcurvebyname, FieldElement,ECPrivateKey,ECPublicKey,Tools
 
 
@@ -25,128 +26,200 @@ MIKRO_SHA256_K = (
   0x1F4726F1, 0x5F393AF0, 0x26E2D004, 0x6D020245,
   0x85FDF6D7, 0xB0237C56, 0xFF5FBD94, 0xA8B3F534
 )
+# maps each alphabet byte to its digit value, everything else to 0xFF
+_SOFTWARE_ID_CHARACTER_VALUES = bytes(
+  SOFTWARE_ID_CHARACTER_TABLE.index(c) if c in SOFTWARE_ID_CHARACTER_TABLE else 0xFF for c in range(256)
+)
+
 def mikro_softwareid_decode(software_id:str)->int:
   assert(isinstance(software_id, str))
-  software_id = software_id.replace('-', '')
+  values = software_id.replace('-', '').encode().translate(_SOFTWARE_ID_CHARACTER_VALUES)
+  if 0xFF in values:
+    raise ValueError(f'invalid character in software id {software_id!r}')
   ret = 0
-  for i in reversed(range(len(software_id))):
-    ret *= len(SOFTWARE_ID_CHARACTER_TABLE)
-    ret += SOFTWARE_ID_CHARACTER_TABLE.index(ord(software_id[i]))
+  for v in reversed(values):
+    ret = ret * len(SOFTWARE_ID_CHARACTER_TABLE) + v
   return ret
 
 def mikro_softwareid_encode(id:int)->str:
   assert(isinstance(id, int))
-  ret = ''
+  ret = bytearray()
   for i in range(8):
-    ret += chr(SOFTWARE_ID_CHARACTER_TABLE[id % len(SOFTWARE_ID_CHARACTER_TABLE)])
-    id //= len(SOFTWARE_ID_CHARACTER_TABLE)
+    id, r = divmod(id, len(SOFTWARE_ID_CHARACTER_TABLE))
+    ret.append(SOFTWARE_ID_CHARACTER_TABLE[r])
     if i == 3:
-      ret += '-'
-  return ret
+      ret.append(ord('-'))
+  return ret.decode()
 
-def to32bits(v):
-  return (v + (1 << 32)) % (1 << 32)
+# per-round word indices, K words and rotate amounts of the license mix
+_MIKRO_MIX_ROUNDS = tuple(
+  (i % 4, (i+1) % 4, (i+2) % 4, (i+3) % 4,
+   MIKRO_SHA256_K[i*4+0], MIKRO_SHA256_K[i*4+1], MIKRO_SHA256_K[i*4+2], MIKRO_SHA256_K[i*4+3],
+   MIKRO_SHA256_K[i*4+0] & 0x0F, MIKRO_SHA256_K[i*4+1] & 0x0F, MIKRO_SHA256_K[i*4+2] & 0x0F, MIKRO_SHA256_K[i*4+3] & 0x0F)
+  for i in range(16)
+)
 
-def rotl(n, d):
-    return (n << d) | (n >> (32 - d))
+def _mikro_mix_fwd(s:list):
+  for i0, i1, i2, i3, k0, k1, k2, k3, r0, r1, r2, r3 in reversed(_MIKRO_MIX_ROUNDS):
+    a, b, c, d = s[i0], s[i1], s[i2], s[i3]
+    a = ((d << r3 | d >> (32 - r3)) ^ (a - d)) & 0xFFFFFFFF
+    d = (d + b + k3) & 0xFFFFFFFF
 
-def mikro_encode(s:bytes)->bytes:
-  s = list(struct.unpack('>' + 'I' * (len(s) // 4), s))
-  for i in reversed(range(16)):
-    s[(i+0) % 4] = to32bits(rotl(s[(i+3) % 4], MIKRO_SHA256_K[i*4+3] & 0x0F) ^ (s[(i+0) % 4] - s[(i+3) % 4]))
-    s[(i+3) % 4] = to32bits(s[(i+3) % 4] + s[(i+1) % 4] + MIKRO_SHA256_K[i*4+3])
+    b = ((c << r2 | c >> (32 - r2)) ^ (b - c)) & 0xFFFFFFFF
+    a = (a + c + k2) & 0xFFFFFFFF
 
-    s[(i+1) % 4] = to32bits(rotl(s[(i+2) % 4], MIKRO_SHA256_K[i*4+2] & 0x0F) ^ (s[(i+1) % 4] - s[(i+2) % 4]))
-    s[(i+0) % 4] = to32bits(s[(i+0) % 4] + s[(i+2) % 4] + MIKRO_SHA256_K[i*4+2])
+    c = ((b << r1 | b >> (32 - r1)) ^ (c - b)) & 0xFFFFFFFF
+    b = (b + d + k1) & 0xFFFFFFFF
 
-    s[(i+2) % 4] = to32bits(rotl(s[(i+1) % 4], MIKRO_SHA256_K[i*4+1] & 0x0F) ^ (s[(i+2) % 4] - s[(i+1) % 4]))
-    s[(i+1) % 4] = to32bits(s[(i+1) % 4] + s[(i+3) % 4] + MIKRO_SHA256_K[i*4+1])
+    d = ((a << r0 | a >> (32 - r0)) ^ (d - a)) & 0xFFFFFFFF
+    c = (c + a + k0) & 0xFFFFFFFF
+    s[i0], s[i1], s[i2], s[i3] = a, b, c, d
 
-    s[(i+3) % 4] = to32bits(rotl(s[(i+0) % 4], MIKRO_SHA256_K[i*4+0] & 0x0F) ^ (s[(i+3) % 4] - s[(i+0) % 4]))
-    s[(i+2) % 4] = to32bits(s[(i+2) % 4] + s[(i+0) % 4] + MIKRO_SHA256_K[i*4+0])
+def _mikro_mix_rev(s:list):
+  for i0, i1, i2, i3, k0, k1, k2, k3, r0, r1, r2, r3 in _MIKRO_MIX_ROUNDS:
+    a, b, c, d = s[i0], s[i1], s[i2], s[i3]
+    c = (c - a - k0) & 0xFFFFFFFF
+    d = (((a << r0 | a >> (32 - r0)) ^ d) + a) & 0xFFFFFFFF
 
-  encodedLicensePayload = b''
-  for x in s:
-    encodedLicensePayload += x.to_bytes(4, 'big')
-  return encodedLicensePayload
+    b = (b - d - k1) & 0xFFFFFFFF
+    c = (((b << r1 | b >> (32 - r1)) ^ c) + b) & 0xFFFFFFFF
 
-def mikro_decode(s:bytes)->bytes:
-    s = list(struct.unpack('>'+'I'*(len(s) // 4), s))
-    for i in range(16):
-        s[(i+2) % 4] = to32bits(s[(i+2) % 4] - s[(i+0) % 4] - MIKRO_SHA256_K[i*4+0])
-        s[(i+3) % 4] = to32bits((rotl(s[(i+0) % 4], MIKRO_SHA256_K[i*4+0] & 0x0F) ^ s[(i+3) % 4]) + s[(i+0) % 4])
+    a = (a - c - k2) & 0xFFFFFFFF
+    b = (((c << r2 | c >> (32 - r2)) ^ b) + c) & 0xFFFFFFFF
 
-        s[(i+1) % 4] = to32bits(s[(i+1) % 4] - s[(i+3) % 4] - MIKRO_SHA256_K[i*4+1])
-        s[(i+2) % 4] = to32bits((rotl(s[(i+1) % 4], MIKRO_SHA256_K[i*4+1] & 0x0F) ^ s[(i+2) % 4]) + s[(i+1) % 4])
+    d = (d - b - k3) & 0xFFFFFFFF
+    a = (((d << r3 | d >> (32 - r3)) ^ a) + d) & 0xFFFFFFFF
+    s[i0], s[i1], s[i2], s[i3] = a, b, c, d
 
-        s[(i+0) % 4] = to32bits(s[(i+0) % 4] - s[(i+2) % 4] - MIKRO_SHA256_K[i*4+2])
-        s[(i+1) % 4] = to32bits((rotl(s[(i+2) % 4], MIKRO_SHA256_K[i*4+2] & 0x0F) ^ s[(i+1) % 4]) + s[(i+2) % 4])
+@lru_cache(maxsize=None)
+def _mikro_words_struct(count:int)->struct.Struct:
+  return struct.Struct('>%dI' % count)
 
-        s[(i+3) % 4] = to32bits(s[(i+3) % 4] - s[(i+1) % 4] - MIKRO_SHA256_K[i*4+3])
-        s[(i+0) % 4] = to32bits((rotl(s[(i+3) % 4], MIKRO_SHA256_K[i*4+3] & 0x0F) ^ s[(i+0) % 4]) + s[(i+3) % 4])
+def mikro_encode(s:bytes)->bytes:
+  words = _mikro_words_struct(len(s) // 4)
+  s = list(words.unpack(s))
+  _mikro_mix_fwd(s)
+  return words.pack(*s)
 
-    ret = b''
-    for x in s:
-      ret += x.to_bytes(4, 'big')
+def mikro_decode(s:bytes)->bytes:
+    words = _mikro_words_struct(len(s) // 4)
+    s = list(words.unpack(s))
+    _mikro_mix_rev(s)
+    return words.pack(*s)
 
-    return ret
 
+# maps each alphabet byte to its 6-bit value, everything else to 0xFF
+_MIKRO_BASE64_DECODE_TABLE = bytes(
+  MIKRO_BASE64_CHARACTER_TABLE.index(c) if c in MIKRO_BASE64_CHARACTER_TABLE else 0xFF for c in range(256)
+)
 
 def mikro_base64_encode(data:bytes, pad = False)->str:
-    encoded = ''
-    left = 0
-    for i in range(0, len(data)):
-      if left == 0:
-        encoded += chr(MIKRO_BASE64_CHARACTER_TABLE[data[i] & 0x3F])
-        left = 2
-      else:
-        if left == 6:
-          encoded += chr(MIKRO_BASE64_CHARACTER_TABLE[data[i - 1] >> 2])
-          encoded += chr(MIKRO_BASE64_CHARACTER_TABLE[data[i] & 0x3F])
-          left = 2
-        else:
-          index1 = data[i - 1] >> (8 - left)
-          index2 = data[i] << (left)
-          encoded += chr(MIKRO_BASE64_CHARACTER_TABLE[(index1 | index2) & 0x3F])
-          left += 2
-
-    if left != 0:
-      encoded += chr(MIKRO_BASE64_CHARACTER_TABLE[data[len(data) - 1] >> (8 - left)])
+    # little-endian bitstream: every 3 bytes become 4 characters
+    table = MIKRO_BASE64_CHARACTER_TABLE
+    tail = len(data) % 3
+    full = len(data) - tail
+    encoded = bytearray()
+    for i in range(0, full, 3):
+      v = data[i] | data[i + 1] << 8 | data[i + 2] << 16
+      encoded += bytes((table[v & 0x3F], table[v >> 6 & 0x3F], table[v >> 12 & 0x3F], table[v >> 18]))
+
+    if tail:
+      v = int.from_bytes(data[full:], 'little')
+      for j in range(tail + 1):
+        encoded.append(table[v >> (6 * j) & 0x3F])
 
     if pad:
-      for i in range(0, (4 - len(encoded) % 4) % 4):
-        encoded += '='
+      encoded += b'=' * ((4 - len(encoded) % 4) % 4)
+
+    return encoded.decode()
 
-    return encoded
 def mikro_base64_decode(data:str)->bytes:
-    ret = b""
-    data = data.replace("=", "").encode()
-    left = 0
-    for i in range(0, len(data)):
-        if left == 0:
-            left = 6
-        else:
-            value1 = MIKRO_BASE64_CHARACTER_TABLE.index(data[i - 1]) >> (6 - left)
-            value2 = MIKRO_BASE64_CHARACTER_TABLE.index(data[i]) & (2 ** (8 - left) - 1)
-            value = value1 | (value2 << left)
-            ret += bytes([value])
-            left -= 2
-    return ret
-
-class MikroSHA256(SHA256):
-  K = MIKRO_SHA256_K
-  INITIAL_STATE = SHA256.State(
-    0x5B653932, 0x7B145F8F, 0x71FFB291, 0x38EF925F,
-    0x03E1AAF9, 0x4A2057CC, 0x4CAF4DD9, 0x643CC9EA
+    values = data.replace("=", "").encode().translate(_MIKRO_BASE64_DECODE_TABLE)
+    if 0xFF in values:
+      raise ValueError('invalid character in MikroTik base64 data')
+    tail = len(values) % 4
+    full = len(values) - tail
+    ret = bytearray()
+    for i in range(0, full, 4):
+      v = values[i] | values[i + 1] << 6 | values[i + 2] << 12 | values[i + 3] << 18
+      ret += v.to_bytes(3, 'little')
+
+    if tail > 1:
+      v = 0
+      for j in range(tail):
+        v |= values[full + j] << (6 * j)
+      ret += (v & ((1 << (8 * (tail - 1))) - 1)).to_bytes(tail - 1, 'little')
+    return bytes(ret)
+
+MIKRO_SHA256_IV = (
+  0x5B653932, 0x7B145F8F, 0x71FFB291, 0x38EF925F,
+  0x03E1AAF9, 0x4A2057CC, 0x4CAF4DD9, 0x643CC9EA
+)
+
+def _mikro_sha256_compress(state:tuple, block:bytes)->tuple:
+  # SHA-256 compression with MikroTik's K table; all state is kept in locals
+  # instead of going through the PySHA256 class' per-operation hooks.
+  w = list(struct.unpack('>16I', block))
+  for i in range(16, 64):
+    x = w[i-15]
+    y = w[i-2]
+    s0 = ((x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)) & 0xFFFFFFFF
+    s1 = ((y >> 17 | y << 15) ^ (y >> 19 | y << 13) ^ (y >> 10)) & 0xFFFFFFFF
+    w.append((w[i-16] + s0 + w[i-7] + s1) & 0xFFFFFFFF)
+  a, b, c, d, e, f, g, h = state
+  for k, wi in zip(MIKRO_SHA256_K, w):
+    S1 = ((e >> 6 | e << 26) ^ (e >> 11 | e << 21) ^ (e >> 25 | e << 7)) & 0xFFFFFFFF
+    t1 = h + S1 + ((e & f) ^ (~e & g)) + k + wi
+    S0 = ((a >> 2 | a << 30) ^ (a >> 13 | a << 19) ^ (a >> 22 | a << 10)) & 0xFFFFFFFF
+    t2 = S0 + ((a & b) ^ (a & c) ^ (b & c))
+    h = g
+    g = f
+    f = e
+    e = (d + t1) & 0xFFFFFFFF
+    d = c
+    c = b
+    b = a
+    a = (t1 + t2) & 0xFFFFFFFF
+  return (
+    (state[0] + a) & 0xFFFFFFFF, (state[1] + b) & 0xFFFFFFFF,
+    (state[2] + c) & 0xFFFFFFFF, (state[3] + d) & 0xFFFFFFFF,
+    (state[4] + e) & 0xFFFFFFFF, (state[5] + f) & 0xFFFFFFFF,
+    (state[6] + g) & 0xFFFFFFFF, (state[7] + h) & 0xFFFFFFFF
   )
 
+class MikroSHA256(PySHA256):
+  K = MIKRO_SHA256_K
+  INITIAL_STATE = PySHA256.State(*MIKRO_SHA256_IV)
+
+  @classmethod
+  def _process_block(cls, message, state=INITIAL_STATE, round_offset=0):
+    return cls.State(*_mikro_sha256_compress(state, message))
+
 def mikro_sha256(data:bytes)->bytes:
-  return MikroSHA256(data).digest()
+  length = len(data)
+  data = b''.join((data, b'\x80', b'\x00' * ((55 - length) % 64), struct.pack('>Q', length * 8)))
+  state = MIKRO_SHA256_IV
+  for offset in range(0, len(data), 64):
+    state = _mikro_sha256_compress(state, data[offset:offset+64])
+  return struct.pack('>8I', *state)
+
+_ED25519 = getcurvebyname('Ed25519')
+_CURVE25519 = getcurvebyname('Curve25519')
+_CURVE_N = _CURVE25519.n
+_CURVE_G = _CURVE25519.G
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:
+    Ed25519PrivateKey = None
 
 def mikro_eddsa_sign(data:bytes,private_key:bytes)->bytes:
     assert(isinstance(data, bytes))
     assert(isinstance(private_key, bytes))
-    curve = getcurvebyname('Ed25519')
+    if Ed25519PrivateKey is not None:
+        return Ed25519PrivateKey.from_private_bytes(private_key).sign(data)
+    curve = _ED25519
     private_key = ECPrivateKey.eddsa_decode(curve,private_key)
     return private_key.eddsa_sign(data).encode()
 
@@ -154,54 +227,89 @@ def mikro_eddsa_verify(data:bytes,signature:bytes,public_key:bytes):
     assert(isinstance(data, bytes))
     assert(isinstance(signature, bytes))
     assert(isinstance(public_key, bytes))
-    curve = getcurvebyname('Ed25519')
+    if Ed25519PrivateKey is not None:
+        try:
+            Ed25519PublicKey.from_public_bytes(public_key).verify(signature,data)
+            return True
+        except InvalidSignature:
+            return False
+    curve = _ED25519
     public_key = ECPublicKey.eddsa_decode(curve,public_key)
     signature = ECPrivateKey.EDDSASignature.decode(curve,signature)
     return public_key.eddsa_verify(data,signature)
 
+def _x25519_mul_u(k:int, u:int) -> int:
+    # RFC 7748 Montgomery ladder on the u coordinate only, without scalar clamping
+    p = 2**255 - 19
+    x1, x2, z2, x3, z3 = u, 1, 0, u, 1
+    swap = 0
+    for t in reversed(range(255)):
+        k_t = (k >> t) & 1
+        swap ^= k_t
+        if swap:
+            x2, x3 = x3, x2
+            z2, z3 = z3, z2
+        swap = k_t
+        A = x2 + z2
+        AA = A * A % p
+        B = x2 - z2
+        BB = B * B % p
+        E = AA - BB
+        C = x3 + z3
+        D = x3 - z3
+        DA = D * A % p
+        CB = C * B % p
+        x3 = (DA + CB) ** 2 % p
+        z3 = x1 * (DA - CB) ** 2 % p
+        x2 = AA * BB % p
+        z2 = E * (AA + 121665 * E) % p
+    if swap:
+        x2, z2 = x3, z3
+    return x2 * pow(z2, p - 2, p) % p
+
+def _kcdsa_data_hash(digest:bytes, nonce_hash:bytes)->int:
+    # xor the nonce hash into bytes 8..23 of the digest, then clamp like an X25519 scalar
+    data_hash = int.from_bytes(digest, 'little') ^ (int.from_bytes(nonce_hash[:16], 'little') << 64)
+    return (data_hash & ~0x07 & ((1 << 255) - 1)) | (1 << 254)
+
 def mikro_kcdsa_sign(data:bytes,private_key:bytes)->bytes:
     assert(isinstance(data, bytes))
     assert(isinstance(private_key, bytes))
-    curve = getcurvebyname('Curve25519')
+    curve = _CURVE25519
     private_key:ECPrivateKey = ECPrivateKey(Tools.bytestoint_le(private_key), curve)
     public_key:ECPublicKey = private_key.pubkey
+    inv_scalar = pow(private_key.scalar, -1, _CURVE_N)
+    digest = mikro_sha256(data)
+    rng = random.SystemRandom()
     while True:
-        nonce_secret = random.SystemRandom().randint(1, curve.n - 1)
-        nonce_point = nonce_secret * curve.G
-        nonce = int(nonce_point.x) % curve.n
+        nonce_secret = rng.randint(1, _CURVE_N - 1)
+        nonce = _x25519_mul_u(nonce_secret, int(_CURVE_G.x)) % _CURVE_N
         nonce_hash = mikro_sha256(Tools.inttobytes_le(nonce,32))
-        data_hash = bytearray(mikro_sha256(data))
-        for i in range(16):
-            data_hash[8+i] ^= nonce_hash[i] 
-        data_hash[0] &= 0xF8
-        data_hash[31] &= 0x7F
-        data_hash[31] |= 0x40
-        data_hash = Tools.bytestoint_le(data_hash)
-        signature = pow(private_key.scalar, -1, curve.n) * (nonce_secret - data_hash)
-        signature %= curve.n
-        if int((public_key.point * signature + curve.G * data_hash).x) == nonce:
+        data_hash = _kcdsa_data_hash(digest, nonce_hash)
+        signature = inv_scalar * (nonce_secret - data_hash)
+        signature %= _CURVE_N
+        # still a generic toyecc multiplication on the full point
+        if int((public_key.point * signature + _CURVE_G * data_hash).x) == nonce:
                 return bytes(nonce_hash[:16]+Tools.inttobytes_le(signature,32))
 
 def mikro_kcdsa_verify(data:bytes, signature:bytes, public_key:bytes)->bool:
     assert(isinstance(data, bytes))
     assert(isinstance(signature, bytes))
     assert(isinstance(public_key, bytes))
-    curve = getcurvebyname('Curve25519')
+    curve = _CURVE25519
     #y^2 = x^3 + ax^2 + x
     x = FieldElement(Tools.bytestoint_le(public_key), curve.p)
     YY = ((x**3) + (curve.a * x**2) + x).sqrt()
-    public_keys = [AffineCurvePoint(int(x), int(y), curve) for y in YY]
-    data_hash = bytearray(mikro_sha256(data))
+    if YY is None:
+        return False
     nonce_hash = signature[:16]
     signature = Tools.bytestoint_le(signature[16:])
-    for i in range(16):
-        data_hash[8+i] ^= nonce_hash[i]
-    data_hash[0] &= 0xF8
-    data_hash[31] &= 0x7F
-    data_hash[31] |= 0x40
-    data_hash = Tools.bytestoint_le(data_hash)
-    for public_key in public_keys:
-        nonce = int((public_key * signature + curve.G * data_hash).x) 
+    data_hash = _kcdsa_data_hash(mikro_sha256(data), nonce_hash)
+    #the two candidate keys are P and -P, so both nonces come from G*h +/- P*s
+    signature_point = AffineCurvePoint(int(x), int(YY[0]), curve) * signature
+    data_point = _CURVE_G * data_hash
+    nonces = [int((data_point + signature_point).x), int((data_point + -signature_point).x)]
+    for nonce in nonces:
         if mikro_sha256(Tools.inttobytes_le(nonce,32))[:len(nonce_hash)] == nonce_hash:
             return True
     return False
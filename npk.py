@@ -1,8 +1,15 @@
 
-import struct,zlib
-import argparse,os
+import struct
+try:
+    # isa-l is a drop-in, much faster deflate; it only supports levels 0-3, so no level is passed
+    from isal import isal_zlib as _zlib
+except ImportError:
+    import zlib as _zlib
+import argparse,os,mmap
 from datetime import datetime
 from dataclasses import dataclass
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 class NpkPartID(IntEnum):
     NAME_INFO               =0x01	# Package information: name, ver, etc.
@@ -23,50 +30,97 @@ class NpkPartID(IntEnum):
     CHANNEL                 =0x18	# Release type (e.g. stable, testing, etc.)
     HEADER                  =0x19	
 
-@dataclass
+_VERSION_BUILD_NAMES = {97:'alpha',98:'beta',99:'rc'}
+_VERSION_BUILD_CODES = {'alpha':97,'beta':98,'rc':99,'final':102}
+
+# raw part payloads; anything else is a structured part with serialize()
+_BUFFER_TYPES = (bytes,bytearray,memoryview,mmap.mmap)
+
+# packages up to this size are joined and hashed in one call rather than part by part
+_ONESHOT_DIGEST_LIMIT = 4*1024*1024
+# below this size computing SHA-1 and SHA-256 on two threads costs more than it saves
+_THREADED_DIGEST_MIN = 64*1024
+# SHA-1 digest, KCDSA signature and EdDSA signature
+_SIGNATURE_SIZE = 20+48+64
+
+_NAME_INFO_STRUCT = struct.Struct('<16s4sI12s')
+_PKG_INFO_STRUCT = struct.Struct('<16s4sI8s')
+_FILE_ITEM_STRUCT = struct.Struct('<BB6sIBBBBIIIH')
+_PART_HEADER_STRUCT = struct.Struct('<HI')
+_MAGIC_STRUCT = struct.Struct('<II')
+_BUILD_TIME_STRUCT = struct.Struct('<I')
+
+_PART_ID_MAP = NpkPartID._value2member_map_
+
 class NpkPartItem:
-    id: NpkPartID
-    data: bytes|object
+    # info parts are kept as raw bytes and only parsed when .parsed is first used
+    __slots__ = ('id','_data','_parsed')
+    def __init__(self,id:NpkPartID,data:bytes|object):
+        self.id = id
+        self._data = data
+        self._parsed = None
+    def __repr__(self)->str:
+        return f'NpkPartItem(id={self.id!r}, data={self.data!r})'
+    @property
+    def data(self)->bytes|object:
+        if self._parsed is not None:
+            return self._parsed.serialize()
+        return self._data
+    @data.setter
+    def data(self,value:bytes|object):
+        self._data = value
+        self._parsed = None
+    @property
+    def parsed(self)->object:
+        if self._parsed is None:
+            parser = _PART_PARSERS.get(self.id)
+            if parser is None or not isinstance(self._data,_BUFFER_TYPES):
+                return self._data
+            self._parsed = parser.unserialize_from(self._data)
+        return self._parsed
 
 class NpkInfo:
-    _format = '<16s4sI8s'
-    def __init__(self,name:str,version:str,build_time=datetime.now(),unknow=b'\x00'*8):
-        self._name = name[:16].encode().ljust(16,b'\x00')
-        self._version = self.encode_version(version)
-        self._build_time = int(build_time.timestamp())
-        self._unknow = unknow
+    # name[16] version[4] build_time(u32) unknow[...], kept packed in a bytearray
+    _struct = _PKG_INFO_STRUCT
+    def __init__(self,name:str,version:str,build_time:datetime=None,unknow=b'\x00'*8):
+        build_time = build_time or datetime.now()
+        self._raw = bytearray(self._struct.size)
+        self._name_str = self._version_str = None
+        self._struct.pack_into(self._raw,0,name[:16].encode(),self.encode_version(version),int(build_time.timestamp()),unknow)
+    @classmethod
+    def _from_raw(cls,data:bytes):
+        assert len(data) == cls._struct.size,'Invalid data length'
+        info = cls.__new__(cls)
+        info._raw = bytearray(data)
+        info._name_str = info._version_str = None
+        return info
     def serialize(self)->bytes:
-        return struct.pack(self._format, self._name,self._version,self._build_time,self._unknow)
+        return bytes(self._raw)
     @staticmethod
     def unserialize_from(data:bytes)->'NpkInfo':
-        assert len(data) == struct.calcsize(NpkInfo._format),'Invalid data length'
-        _name, _version,_build_time,unknow= struct.unpack_from(NpkInfo._format,data)
-        return NpkInfo(_name.decode(),NpkInfo.decode_version(_version),datetime.fromtimestamp(_build_time),unknow)
+        return NpkInfo._from_raw(data)
     def __len__ (self)->int:
-        return struct.calcsize(self._format)
+        return self._struct.size
     @property
     def name(self)->str:
-        return self._name.decode().strip('\x00')
+        if self._name_str is None:
+            self._name_str = self._raw[0:16].decode().strip('\x00')
+        return self._name_str
     @name.setter
     def name(self,value:str):
-        self._name = value[:16].encode().ljust(16,b'\x00')
+        self._raw[0:16] = value[:16].encode().ljust(16,b'\x00')[:16]
+        self._name_str = None
     @staticmethod
     def decode_version(value:bytes):
-        revision,build,minor,major = struct.unpack_from('4B',value)
-        if build == 97:
-            build = 'alpha'
-        elif build == 98:
-            build = 'beta'
-        elif build == 99:
-            build = 'rc'
-        elif build == 102:
+        revision,build,minor,major = value[0],value[1],value[2],value[3]
+        if build == 102:
             if revision & 0x80:
                 build = 'test'
                 revision &= 0x7f
             else:
                 build = 'final'
         else:
-            build = 'unknown'
+            build = _VERSION_BUILD_NAMES.get(build,'unknown')
         return f'{major}.{minor}.{revision}.{build}'
     @staticmethod
     def encode_version(value:str):
@@ -76,50 +130,44 @@ class NpkInfo:
         major = int(s[0])
         minor = int(s[1])
         revision = int(s[2])
-        if s[3] == 'alpha':
-            build = 97
-        elif s[3] == 'beta':
-            build = 98
-        elif s[3] == 'rc':
-            build = 99
-        elif s[3] == 'final':
-            build = 102
-            revision &= 0x7f
-        else: #'test'
+        build = _VERSION_BUILD_CODES.get(s[3])
+        if build is None: #'test'
             build = 102
             revision |= 0x80
-        return struct.pack('4B',revision,build,minor,major)
+        elif s[3] == 'final':
+            revision &= 0x7f
+        return bytes((revision,build,minor,major))
     @property
     def version(self)->str:
-        return self.decode_version(self._version)
+        if self._version_str is None:
+            self._version_str = self.decode_version(self._raw[16:20])
+        return self._version_str
     @version.setter
     def version(self,value:str = '7.15.1.final'):
-        self._version = self.encode_version(value)
+        self._raw[16:20] = self.encode_version(value)
+        self._version_str = None
     @property
     def build_time(self):
-        return datetime.fromtimestamp(self._build_time) 
+        return datetime.fromtimestamp(_BUILD_TIME_STRUCT.unpack_from(self._raw,20)[0]) 
     @build_time.setter
     def build_time(self,value:datetime):
-        self._build_time = int(value.timestamp())
+        self.patch_build_time(int(value.timestamp()))
+    def patch_build_time(self,timestamp:int):
+        _BUILD_TIME_STRUCT.pack_into(self._raw,20,timestamp)
 
 class NpkNameInfo(NpkInfo):
-    _format = '<16s4sI12s'
-    def __init__(self,name:str,version:str,build_time=datetime.now(),unknow=b'\x00'*12):
-        self._name = name[:16].encode().ljust(16,b'\x00')
-        self._version = self.encode_version(version)
-        self._build_time = int(build_time.timestamp())
-        self._unknow = unknow
-    def serialize(self)->bytes:
-        return struct.pack(self._format, self._name,self._version,self._build_time,self._unknow)
+    _struct = _NAME_INFO_STRUCT
+    def __init__(self,name:str,version:str,build_time:datetime=None,unknow=b'\x00'*12):
+        super().__init__(name,version,build_time,unknow)
     @staticmethod
     def unserialize_from(data:bytes)->'NpkNameInfo':
-        assert len(data) == struct.calcsize(NpkNameInfo._format),'Invalid data length'
-        _name, _version,_build_time,_unknow = struct.unpack_from(NpkNameInfo._format,data)
-        return NpkNameInfo(_name.decode(),NpkNameInfo.decode_version(_version),datetime.fromtimestamp(_build_time),_unknow)
+        return NpkNameInfo._from_raw(data)
+
+_PART_PARSERS = {NpkPartID.NAME_INFO:NpkNameInfo,NpkPartID.PKG_INFO:NpkInfo}
 
 class NpkFileContainer:
-    _format = '<BB6sIBBBBIIIH'
-    @dataclass
+    _struct = _FILE_ITEM_STRUCT
+    @dataclass(slots=True)
     class NpkFileItem:
         perm: int
         type: int
@@ -136,24 +184,44 @@ class NpkFileContainer:
     def __init__(self,items:list['NpkFileContainer.NpkFileItem']=None):
         self._items= items
     def serialize(self)->bytes:
-        compressed_data = b''
-        compressor = zlib.compressobj()
+        chunks = []
+        pack = self._struct.pack
         for item in self._items:
-            data = struct.pack(self._format, item.perm,item.type,item.usr_or_grp, item.modify_time,item.revision,item.rc,item.minor,item.major,item.create_time,item.unknow,len(item.data),len(item.name)) 
-            data += item.name + item.data
-            compressed_data += compressor.compress(data)
-        return compressed_data + compressor.flush()
+            chunks.append(pack(item.perm,item.type,item.usr_or_grp, item.modify_time,item.revision,item.rc,item.minor,item.major,item.create_time,item.unknow,len(item.data),len(item.name)))
+            chunks.append(item.name)
+            chunks.append(item.data)
+        return NpkFileContainer.pack(b''.join(chunks))
+    @staticmethod
+    def pack(decompressed_data:bytes)->bytes:
+        return _zlib.compress(decompressed_data)
+    @staticmethod
+    def locate(data:bytes)->tuple[bytearray,dict[bytes,tuple[int,int]]]:
+        # walks the item headers only; the caller can patch item data in the returned buffer and pack() it
+        decompressed_data = bytearray(_zlib.decompress(data))
+        spans:dict[bytes,tuple[int,int]] = {}
+        header_size = _FILE_ITEM_STRUCT.size
+        pos = 0
+        while pos < len(decompressed_data):
+            data_size,name_size = _FILE_ITEM_STRUCT.unpack_from(decompressed_data, pos)[-2:]
+            name_start = pos + header_size
+            data_start = name_start + name_size
+            pos = data_start + data_size
+            spans[bytes(decompressed_data[name_start:data_start])] = (data_start,pos)
+        return decompressed_data,spans
     @staticmethod
     def unserialize_from(data:bytes):
         items:list['NpkFileContainer.NpkFileItem'] = []
-        decompressed_data = zlib.decompress(data)
-        while len(decompressed_data):
-            offset = struct.calcsize(NpkFileContainer._format)
-            perm,type,usr_or_grp, modify_time,revision,rc,minor,major,create_time,unknow,data_size,name_size= struct.unpack_from(NpkFileContainer._format, decompressed_data)
-            name = decompressed_data[offset:offset+name_size]
-            data = decompressed_data[offset+name_size:offset+name_size+data_size]
+        decompressed_data = memoryview(_zlib.decompress(data))
+        header_size = _FILE_ITEM_STRUCT.size
+        pos = 0
+        while pos < len(decompressed_data):
+            perm,type,usr_or_grp, modify_time,revision,rc,minor,major,create_time,unknow,data_size,name_size= _FILE_ITEM_STRUCT.unpack_from(decompressed_data, pos)
+            name_start = pos + header_size
+            data_start = name_start + name_size
+            pos = data_start + data_size
+            name = bytes(decompressed_data[name_start:data_start])
+            data = bytes(decompressed_data[data_start:pos])
             items.append(NpkFileContainer.NpkFileItem(perm,type,usr_or_grp, modify_time,revision,rc,minor,major,create_time,unknow,name,data))
-            decompressed_data = decompressed_data[offset+name_size+data_size:]
         return NpkFileContainer(items)
 
     def __len__ (self)->int:
@@ -167,99 +235,138 @@ class NpkFileContainer:
 class Package:
     def __init__(self) -> None:
         self._parts:list[NpkPartItem] = []
+        self._index:dict[NpkPartID,NpkPartItem] = {}
     def __iter__(self):
         for part in self._parts:
             yield part
     def __getitem__(self, id:NpkPartID):
-        for part in self._parts:
-            if part.id == id:
-                return part
+        part = self._index.get(id)
+        if part is not None:
+            return part
         part = NpkPartItem(id,b'')
-        self._parts.append(part)
+        self._append(part)
         return part
+    def _append(self,part:NpkPartItem):
+        self._parts.append(part)
+        # lookups return the first part with a given id
+        self._index.setdefault(part.id,part)
 
 class NovaPackage(Package):
     NPK_MAGIC = 0xbad0f11e
-    def __init__(self,data:bytes=b''):
+    def __init__(self,data:bytes|memoryview=b''):
         super().__init__()
         self._packages:list[Package] = []
         offset = 0
         self._has_pkg = False
         while offset < len(data):
-            part_id,part_size = struct.unpack_from('<HI',data,offset)
-            offset += 6
-            part_data = data[offset:offset+part_size]
+            part_id,part_size = _PART_HEADER_STRUCT.unpack_from(data,offset)
+            offset += _PART_HEADER_STRUCT.size
+            part_view = data[offset:offset+part_size]
             offset += part_size
+            # unknown ids stay plain ints so newer packages still load
+            part_id = _PART_ID_MAP.get(part_id,part_id)
             if part_id == NpkPartID.PKG_FEATURES:
                 self._has_pkg = True
-                self._parts.append(NpkPartItem(NpkPartID(part_id),part_data))
+                self._append(NpkPartItem(part_id,bytes(part_view)))
                 continue
             if self._has_pkg:
                 if part_id == NpkPartID.NAME_INFO:
                     self._packages.append(Package())
-                    self._packages[-1]._parts.append(NpkPartItem(NpkPartID(part_id),NpkNameInfo.unserialize_from(part_data)))
-                else:
-                    self._packages[-1]._parts.append(NpkPartItem(NpkPartID(part_id),part_data))
+                self._packages[-1]._append(NpkPartItem(part_id,bytes(part_view)))
             else:
-                if part_id == NpkPartID.NAME_INFO:
-                    self._parts.append(NpkPartItem(NpkPartID(part_id),NpkNameInfo.unserialize_from(part_data)))
-                elif part_id == NpkPartID.PKG_INFO:
-                    self._parts.append(NpkPartItem(NpkPartID(part_id),NpkInfo.unserialize_from(part_data)))
-                else:
-                    self._parts.append(NpkPartItem(NpkPartID(part_id),part_data))
+                self._append(NpkPartItem(part_id,bytes(part_view)))
     
-    def get_digest(self,hash_fnc,package:Package=None)->bytes:
+    def _signed_parts(self,package:Package=None):
+        # (id, payload, hashed) for every part covered by the signature; only the signature's header is hashed
         parts = package._parts if package else self._parts
         for part in parts:
-            data_header = struct.pack('<HI',part.id.value,len(part.data))
             if part.id == NpkPartID.HEADER:
                 continue
-            else:
-                hash_fnc.update(data_header)
-                if part.id == NpkPartID.SIGNATURE:
-                    break
-                elif part.data:
-                    if isinstance(part.data,bytes):
-                        hash_fnc.update(part.data)
-                    else:
-                        hash_fnc.update(part.data.serialize())
+            if part.id == NpkPartID.SIGNATURE:
+                yield part.id,part.data,False
+                break
+            yield part.id,part.data if isinstance(part.data,_BUFFER_TYPES) else part.data.serialize(),True
+
+    def _digest_chunks(self,package:Package=None)->list:
+        # the byte ranges covered by the package signature, in order
+        signed = list(self._signed_parts(package))
+        headers = memoryview(bytearray(_PART_HEADER_STRUCT.size * len(signed)))
+        chunks = []
+        offset = 0
+        for part_id,payload,hashed in signed:
+            _PART_HEADER_STRUCT.pack_into(headers,offset,part_id,len(payload))
+            chunks.append(headers[offset:offset+_PART_HEADER_STRUCT.size])
+            offset += _PART_HEADER_STRUCT.size
+            if hashed and payload:
+                chunks.append(payload)
+        return chunks
+
+    def _update_digests(self,hashers:list,package:Package=None):
+        # hashers copy what they are fed, so one header buffer is reused for every part
+        header = bytearray(_PART_HEADER_STRUCT.size)
+        for part_id,payload,hashed in self._signed_parts(package):
+            _PART_HEADER_STRUCT.pack_into(header,0,part_id,len(payload))
+            for hasher in hashers:
+                hasher.update(header)
+                if hashed and payload:
+                    hasher.update(payload)
+
+    def get_digest(self,hash_fnc,package:Package=None)->bytes:
+        self._update_digests([hash_fnc],package)
         return hash_fnc.digest()    
+
+    def _get_digests(self,package:Package=None)->tuple[bytes,bytes]:
+        import hashlib
+        chunks = self._digest_chunks(package)
+        size = sum(len(chunk) for chunk in chunks)
+        if size <= _ONESHOT_DIGEST_LIMIT:
+            chunks = [b''.join(chunks)]
+        def digest(hasher):
+            for chunk in chunks:
+                hasher.update(chunk)
+            return hasher.digest()
+        if size <= _THREADED_DIGEST_MIN:
+            return digest(hashlib.sha1()),digest(hashlib.sha256())
+        # hashlib releases the GIL on large updates, so both digests run concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            sha1 = executor.submit(digest,hashlib.sha1())
+            sha256 = executor.submit(digest,hashlib.sha256())
+            return sha1.result(),sha256.result()
    
     def sign(self,kcdsa_private_key:bytes,eddsa_private_key:bytes):
-        import hashlib
         from mikro import mikro_kcdsa_sign,mikro_eddsa_sign
         build_time = os.environ['BUILD_TIME'] if 'BUILD_TIME' in os.environ else None
         if len(self._packages) > 0:
             if build_time:
-                self[NpkPartID.PKG_INFO].data._build_time = int(build_time)
+                self[NpkPartID.PKG_INFO].parsed.patch_build_time(int(build_time))
             for package in self._packages:
-                if len(package[NpkPartID.SIGNATURE].data) != 20+48+64:
-                    package[NpkPartID.SIGNATURE].data = b'\0'*(20+48+64)
+                if len(package[NpkPartID.SIGNATURE].data) != _SIGNATURE_SIZE:
+                    package[NpkPartID.SIGNATURE].data = bytes(_SIGNATURE_SIZE)
                 if build_time:
-                    package[NpkPartID.NAME_INFO].data._build_time = int(build_time)
-                sha1_digest = self.get_digest(hashlib.new('SHA1'),package)
-                sha256_digest = self.get_digest(hashlib.new('SHA256'),package)
-                kcdsa_signature = mikro_kcdsa_sign(sha256_digest[:20],kcdsa_private_key)
-                eddsa_signature = mikro_eddsa_sign(sha256_digest,eddsa_private_key)
-                package[NpkPartID.SIGNATURE].data = sha1_digest + kcdsa_signature + eddsa_signature
+                    package[NpkPartID.NAME_INFO].parsed.patch_build_time(int(build_time))
+                sha1_digest,sha256_digest = self._get_digests(package)
+                signature = bytearray(_SIGNATURE_SIZE)
+                signature[0:20] = sha1_digest
+                signature[20:68] = mikro_kcdsa_sign(sha256_digest[:20],kcdsa_private_key)
+                signature[68:132] = mikro_eddsa_sign(sha256_digest,eddsa_private_key)
+                package[NpkPartID.SIGNATURE].data = bytes(signature)
         else:
-            if len(self[NpkPartID.SIGNATURE].data) != 20+48+64:
-                self[NpkPartID.SIGNATURE].data = b'\0'*(20+48+64)
+            if len(self[NpkPartID.SIGNATURE].data) != _SIGNATURE_SIZE:
+                self[NpkPartID.SIGNATURE].data = bytes(_SIGNATURE_SIZE)
             if build_time:
-                self[NpkPartID.NAME_INFO].data._build_time = int(build_time)
-            sha1_digest = self.get_digest(hashlib.new('SHA1'))
-            sha256_digest = self.get_digest(hashlib.new('SHA256'))
-            kcdsa_signature = mikro_kcdsa_sign(sha256_digest[:20],kcdsa_private_key)
-            eddsa_signature = mikro_eddsa_sign(sha256_digest,eddsa_private_key)
-            self[NpkPartID.SIGNATURE].data = sha1_digest + kcdsa_signature + eddsa_signature
+                self[NpkPartID.NAME_INFO].parsed.patch_build_time(int(build_time))
+            sha1_digest,sha256_digest = self._get_digests()
+            signature = bytearray(_SIGNATURE_SIZE)
+            signature[0:20] = sha1_digest
+            signature[20:68] = mikro_kcdsa_sign(sha256_digest[:20],kcdsa_private_key)
+            signature[68:132] = mikro_eddsa_sign(sha256_digest,eddsa_private_key)
+            self[NpkPartID.SIGNATURE].data = bytes(signature)
 
     def verify(self,kcdsa_public_key:bytes,eddsa_public_key:bytes):
-        import hashlib
         from mikro import mikro_kcdsa_verify,mikro_eddsa_verify
         if len(self._packages) > 0:
             for package in self._packages:
-                sha1_digest = self.get_digest(hashlib.new('SHA1'),package)
-                sha256_digest = self.get_digest(hashlib.new('SHA256'),package)
+                sha1_digest,sha256_digest = self._get_digests(package)
                 signature = package[NpkPartID.SIGNATURE].data
                 if sha1_digest != signature[:20]: 
                     return False
@@ -268,8 +375,7 @@ class NovaPackage(Package):
                 if not mikro_eddsa_verify(sha256_digest,signature[68:132],eddsa_public_key):
                     return False
         else:
-            sha1_digest = self.get_digest(hashlib.new('SHA1'))
-            sha256_digest = self.get_digest(hashlib.new('SHA256'))
+            sha1_digest,sha256_digest = self._get_digests()
             signature = self[NpkPartID.SIGNATURE].data
             if sha1_digest != signature[:20]: 
                 return False
@@ -281,35 +387,34 @@ class NovaPackage(Package):
         return True
             
     def save(self,file):
-        size = 0
-        for part in self._parts:
-            size += 6 + len(part.data)
+        parts = list(self._parts)
         for package in self._packages:
-            for part in package:
-                size += 6 + len(part.data)
+            parts.extend(package)
+        # gather headers and payloads and hand them over at once, without copying payloads into one buffer
+        headers = memoryview(bytearray(_MAGIC_STRUCT.size + _PART_HEADER_STRUCT.size * len(parts)))
+        chunks = [headers[:_MAGIC_STRUCT.size]]
+        offset = _MAGIC_STRUCT.size
+        size = 0
+        for part in parts:
+            blob = part.data if isinstance(part.data,_BUFFER_TYPES) else part.data.serialize()
+            _PART_HEADER_STRUCT.pack_into(headers,offset,part.id,len(blob))
+            chunks.append(headers[offset:offset+_PART_HEADER_STRUCT.size])
+            chunks.append(blob)
+            offset += _PART_HEADER_STRUCT.size
+            size += _PART_HEADER_STRUCT.size + len(blob)
+        _MAGIC_STRUCT.pack_into(headers,0,NovaPackage.NPK_MAGIC,size)
         with open(file,'wb') as f:
-            f.write(struct.pack('<II', NovaPackage.NPK_MAGIC, size))
-            for part in self._parts:
-                f.write(struct.pack('<HI',part.id.value ,len(part.data)))
-                if isinstance(part.data,bytes):
-                    f.write(part.data)
-                else:
-                    f.write(part.data.serialize())
-            for package in self._packages:
-                for part in package:
-                    f.write(struct.pack('<HI',part.id.value ,len(part.data)))
-                    if isinstance(part.data,bytes):
-                        f.write(part.data)
-                    else:
-                        f.write(part.data.serialize())
+            f.writelines(chunks)
 
     @staticmethod
     def load(file):
-        with open(file,'rb') as f:
-            data = f.read()
-        assert int.from_bytes(data[:4],'little') == NovaPackage.NPK_MAGIC, 'Invalid Nova Package Magic'
-        assert int.from_bytes(data[4:8],'little') == len(data) - 8, 'Invalid Nova Package Size'
-        return NovaPackage(data[8:])
+        # parts are copied out of the mapping, so it can be closed once parsed
+        with open(file,'rb') as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as data:
+                magic,size = _MAGIC_STRUCT.unpack_from(data,0)
+                assert magic == NovaPackage.NPK_MAGIC, 'Invalid Nova Package Magic'
+                assert size == len(data) - _MAGIC_STRUCT.size, 'Invalid Nova Package Size'
+                return NovaPackage(data[_MAGIC_STRUCT.size:])
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser(description='nova package creator and editor')
@@ -348,12 +453,16 @@ if __name__=='__main__':
     elif args.command =='create':
         print(f'Creating {args.output} from {args.input}')
         option_npk = NovaPackage.load(args.input)
-        option_npk[NpkPartID.NAME_INFO].data.name = args.name
+        option_npk[NpkPartID.NAME_INFO].parsed.name = args.name
         option_npk[NpkPartID.DESCRIPTION].data = args.description.encode() if args.description else args.name.encode()
         option_npk[NpkPartID.NULL_BLOCK].data = b''
-        option_npk[NpkPartID.SQUASHFS].data = open(args.squashfs,'rb').read() 
-        option_npk.sign(kcdsa_private_key,eddsa_private_key)
-        option_npk.save(args.output)
+        with open(args.squashfs,'rb') as f:
+            # mmap refuses empty files, those are taken as they are
+            mapping = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else nullcontext(b'')
+            with mapping as squashfs:
+                option_npk[NpkPartID.SQUASHFS].data = squashfs
+                option_npk.sign(kcdsa_private_key,eddsa_private_key)
+                option_npk.save(args.output)
         print(f'Created {args.output}')
     else:
         parser.print_help()
\ No newline at end of file
@@ -20,11 +20,11 @@ def install_package(package, version="upgrade", index_url='https://mirrors.aliyu
         result = -1
     return result    
 def check_package(package):
-    from importlib import import_module
+    # locate the module without executing it
+    from importlib.util import find_spec
     try:
-        import_module(package)
-        return True
-    except ImportError:
+        return find_spec(package) is not None
+    except (ImportError, ValueError):
         return False 
 def check_install_package(packages):
     for package in packages:
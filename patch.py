@@ -1,21 +1,90 @@
-import subprocess,lzma
-import struct,os,re
+import subprocess,lzma,hashlib,tempfile
+try:
+    # blake3 hashes large buffers several times faster than sha256; it is only used for cache keys
+    from blake3 import blake3 as _cache_hash
+except ImportError:
+    _cache_hash = hashlib.sha256
+import struct,os,re,mmap,shutil
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor
+from itertools import repeat
+from functools import lru_cache
 from npk import NovaPackage,NpkPartID,NpkFileContainer
 
-def replace_key(old,new,data):
+# ids of the first three {id,name_ptr,data_ptr,data_size} entries of the ELF netinstall bootloader table
+BOOTLOADER_TABLE_IDS = (b'\x83\x00\x00\x00',b'\x8A\x00\x00\x00',b'\x81\x00\x00\x00')
+
+def find_bootloader_table(data:bytes):
+    first_id,second_id,third_id = BOOTLOADER_TABLE_IDS
+    offset = data.find(first_id)
+    while offset >= 0 and offset+48 <= len(data):
+        if data[offset+16:offset+20] == second_id and data[offset+32:offset+36] == third_id:
+            return offset
+        offset = data.find(first_id,offset+1)
+    raise Exception('bootloader table not found')
+
+@lru_cache
+def key_pattern(old:bytes):
+    # public keys may be split into 4-byte chunks with up to 6 bytes in between; each key gets its own
+    # pattern, which starts with a fixed literal so re can skip ahead to candidate offsets
     old_chunks = [old[i:i+4] for i in range(0, len(old), 4)]
-    new_chunks = [new[i:i+4] for i in range(0, len(new), 4)]
     pattern_parts = [re.escape(chunk) + b'(.{0,6})' for chunk in old_chunks[:-1]]
     pattern_parts.append(re.escape(old_chunks[-1])) 
-    pattern_bytes = b''.join(pattern_parts)
-    pattern = re.compile(pattern_bytes, flags=re.DOTALL) 
-    def replace_match(match):
-        print(f'public key patched {old[:16].hex().upper()}...')
-        replaced = b''.join([new_chunks[i] + match.group(i+1) for i in range(len(new_chunks) - 1)])
-        replaced += new_chunks[-1]
-        return replaced
-    return re.sub(pattern, replace_match, data)
+    return re.compile(b''.join(pattern_parts), flags=re.DOTALL) 
+
+def patch_keys(buf:bytearray,key_dict:dict,pos=0,endpos=None):
+    # the chunks are rewritten in place and the gaps kept, so the buffer never changes size
+    count,_ = patch_many(buf,key_dict,{},pos,endpos)
+    return count
+
+def patch_many(buf:bytearray,key_dict:dict,literal_dict:dict,pos=0,endpos=None,log=print):
+    # keys are rewritten in place in buf, literals may change length so they are returned
+    # as (start,end,new) spans for the caller to splice
+    endpos = len(buf) if endpos is None else endpos
+    count = 0
+    for old,new in key_dict.items():
+        for match in key_pattern(old).finditer(buf,pos,endpos):
+            log(f'public key patched {old[:16].hex().upper()}...')
+            for i in range(0,len(new),4):
+                start = match.end(i//4) if i else match.start()
+                buf[start:start+len(new[i:i+4])] = new[i:i+4]
+            count += 1
+    found = []
+    for old,new in literal_dict.items():
+        if not old:
+            # an empty literal would be found at every offset
+            continue
+        start = buf.find(old,pos,endpos)
+        while start >= 0:
+            found.append((start,start+len(old),new))
+            start = buf.find(old,start+len(old),endpos)
+    # in offset order; where literals overlap the longer one wins
+    found.sort(key=lambda span:(span[0],span[0]-span[1]))
+    spans = []
+    for span in found:
+        if not spans or span[0] >= spans[-1][1]:
+            spans.append(span)
+    return count,spans
+
+def decompress_vmlinux(vmlinux_xz:bytes,size:int=None):
+    if size is None:
+        return lzma.decompress(vmlinux_xz)
+    # the size from the bzImage header only bounds the output; a stream that does not end there is rejected
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    vmlinux = decompressor.decompress(vmlinux_xz,max_length=size)
+    assert decompressor.eof, 'vmlinux is larger than expected'
+    return vmlinux
 
+def compress_vmlinux(vmlinux:bytes,limit:int):
+    return xz_compress(vmlinux,limit,
+        [{"id": lzma.FILTER_X86},{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": min(xz_dict_size(vmlinux),32*1024*1024)}],
+        [
+        {"id": lzma.FILTER_X86},
+        {"id": lzma.FILTER_LZMA2, 
+         "preset": 9 | lzma.PRESET_EXTREME,
+         'dict_size': 32*1024*1024,
+          "lc": 4,"lp": 0, "pb": 0,
+         },
+        ])
 
 def patch_bzimage(data:bytes,key_dict:dict):
     PE_TEXT_SECTION_OFFSET = 414
@@ -26,36 +95,33 @@ def patch_bzimage(data:bytes,key_dict:dict):
     payload_length = struct.unpack_from('<I',data,HEADER_PAYLOAD_LENGTH_OFFSET)[0]
     payload_length = payload_length - 4 #last 4 bytes is uncompressed size(z_output_len)
     z_output_len = struct.unpack_from('<I',data,payload_offset+payload_length)[0]
-    vmlinux_xz = data[payload_offset:payload_offset+payload_length]
-    vmlinux = lzma.decompress(vmlinux_xz)
+    vmlinux_xz = memoryview(data)[payload_offset:payload_offset+payload_length]
+    vmlinux = decompress_vmlinux(vmlinux_xz,z_output_len)
     assert z_output_len == len(vmlinux), 'vmlinux size is not equal to expected'
     CPIO_HEADER_MAGIC = b'07070100'
     CPIO_FOOTER_MAGIC = b'TRAILER!!!\x00\x00\x00\x00' #545241494C455221212100000000
     cpio_offset1 = vmlinux.index(CPIO_HEADER_MAGIC)
-    initramfs = vmlinux[cpio_offset1:]
-    cpio_offset2 = initramfs.index(CPIO_FOOTER_MAGIC)+len(CPIO_FOOTER_MAGIC)
-    initramfs = initramfs[:cpio_offset2]
-    new_initramfs = initramfs       
-    for old_public_key,new_public_key in key_dict.items():
-        new_initramfs = replace_key(old_public_key,new_public_key,new_initramfs)
-    new_vmlinux = vmlinux.replace(initramfs,new_initramfs)
-    new_vmlinux_xz = lzma.compress(new_vmlinux,check=lzma.CHECK_CRC32,filters=[
-            {"id": lzma.FILTER_X86},
-            {"id": lzma.FILTER_LZMA2, 
-             "preset": 9 | lzma.PRESET_EXTREME,
-             'dict_size': 32*1024*1024,
-              "lc": 4,"lp": 0, "pb": 0,
-             },
-        ])
+    cpio_offset2 = vmlinux.index(CPIO_FOOTER_MAGIC,cpio_offset1)+len(CPIO_FOOTER_MAGIC)
+    # a split key still starts with its first 4 bytes verbatim; without any of them there is nothing to copy and scan
+    if all(vmlinux.find(old_public_key[:4],cpio_offset1,cpio_offset2) < 0 for old_public_key in key_dict):
+        return data
+    new_vmlinux = bytearray(vmlinux)
+    patched = patch_keys(new_vmlinux,key_dict,cpio_offset1,cpio_offset2)
+    if not patched:
+        return data
+    new_vmlinux_xz = compress_vmlinux(new_vmlinux,payload_length)
     new_payload_length = len(new_vmlinux_xz)
     assert new_payload_length <= payload_length , 'new vmlinux.xz size is too big'
     new_payload_length = new_payload_length + 4 #last 4 bytes is uncompressed size(z_output_len)
-    new_data = bytearray(data)
+    # assembled into a zeroed buffer, so the padding behind the new payload needs no writing
+    payload_end = payload_offset+payload_length+4
+    source = memoryview(data)
+    new_data = bytearray(len(data))
+    new_data[:payload_offset] = source[:payload_offset]
+    new_data[payload_offset:payload_offset+len(new_vmlinux_xz)] = new_vmlinux_xz
+    struct.pack_into('<I',new_data,payload_offset+len(new_vmlinux_xz),z_output_len)
+    new_data[payload_end:] = source[payload_end:]
     struct.pack_into('<I',new_data,HEADER_PAYLOAD_LENGTH_OFFSET,new_payload_length)
-    vmlinux_xz += struct.pack('<I',z_output_len)
-    new_vmlinux_xz += struct.pack('<I',z_output_len)
-    new_vmlinux_xz = new_vmlinux_xz.ljust(len(vmlinux_xz),b'\0')
-    new_data = new_data.replace(vmlinux_xz,new_vmlinux_xz)
     return new_data
 
 def patch_block(dev:str,file:str,key_dict):
@@ -84,27 +150,60 @@ def patch_block(dev:str,file:str,key_dict):
     data,stderr = run_shell_command(f"debugfs {dev} -R 'cat {file}' 2> /dev/null")
     new_data = patch_kernel(data,key_dict)
     print(f'write block {len(blocks)} : [',end="")
-    with open(dev,'wb') as f:
-        for index,block_id in enumerate(blocks):
-            print('#',end="")
-            f.seek(block_id*BLOCK_SIZE)
-            f.write(new_data[index*BLOCK_SIZE:(index+1)*BLOCK_SIZE])
-        f.flush()
-        print(']')
+    fd = os.open(dev,os.O_WRONLY)
+    try:
+        index = 0
+        while index < len(blocks):
+            # consecutive blocks on the device are written with a single call
+            count = 1
+            while index+count < len(blocks) and blocks[index+count] == blocks[index]+count:
+                count += 1
+            os.pwrite(fd,new_data[index*BLOCK_SIZE:(index+count)*BLOCK_SIZE],blocks[index]*BLOCK_SIZE)
+            print('#'*count,end="")
+            index += count
+    finally:
+        os.close(fd)
+    print(']')
+
+def xz_dict_size(data:bytes):
+    # a dictionary larger than the input can't improve the ratio, only cost memory
+    return max(1<<16, 1<<len(data).bit_length())
+
+def xz_compress(data:bytes,limit:int,*filter_chains):
+    # filter chains go from cheapest to strongest; the first stream that fits in limit is kept
+    for filters in filter_chains:
+        data_xz = lzma.compress(data,check=lzma.CHECK_CRC32,filters=filters)
+        if len(data_xz) <= limit:
+            break
+    return data_xz
+
+# (hash of the original xz stream, key pairs, ljust) -> patched xz stream
+_INITRD_CACHE = {}
 
 def patch_initrd_xz(initrd_xz:bytes,key_dict:dict,ljust=True):
-    initrd = lzma.decompress(initrd_xz)
-    new_initrd = initrd  
-    for old_public_key,new_public_key in key_dict.items():
-        new_initrd = replace_key(old_public_key,new_public_key,new_initrd)
+    cache_key = (_cache_hash(initrd_xz).digest(),tuple(key_dict.items()),ljust)
+    if cache_key not in _INITRD_CACHE:
+        new_initrd_xz = _patch_initrd_xz(initrd_xz,key_dict,ljust)
+        # None marks an initrd without keys, so callers still get their own object back
+        _INITRD_CACHE[cache_key] = None if new_initrd_xz is initrd_xz else new_initrd_xz
+    else:
+        print('initrd already patched, reusing result')
+    return _INITRD_CACHE[cache_key] or initrd_xz
+
+def _patch_initrd_xz(initrd_xz:bytes,key_dict:dict,ljust=True):
+    new_initrd = bytearray(lzma.decompress(initrd_xz))
+    patched = patch_keys(new_initrd,key_dict)
+    if not patched:
+        return initrd_xz
     preset = 6
-    new_initrd_xz = lzma.compress(new_initrd,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": preset }] )
+    dict_size = xz_dict_size(new_initrd)
+    new_initrd_xz = lzma.compress(new_initrd,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": preset, "dict_size": dict_size }] )
     while len(new_initrd_xz) > len(initrd_xz) and preset < 9:
         print(f'preset:{preset}')
         print(f'new initrd xz size:{len(new_initrd_xz)}')
         print(f'old initrd xz size:{len(initrd_xz)}')
         preset += 1
-        new_initrd_xz = lzma.compress(new_initrd,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": preset }] )
+        new_initrd_xz = lzma.compress(new_initrd,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": preset, "dict_size": dict_size }] )
     if len(new_initrd_xz) > len(initrd_xz):
         new_initrd_xz = lzma.compress(new_initrd,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": 9 | lzma.PRESET_EXTREME,'dict_size': 32*1024*1024,"lc": 4,"lp": 0, "pb": 0,}] )
     if ljust:
@@ -116,46 +215,117 @@ def patch_initrd_xz(initrd_xz:bytes,key_dict:dict,ljust=True):
         new_initrd_xz = new_initrd_xz.ljust(len(initrd_xz),b'\0')
     return new_initrd_xz
 
-def find_7zXZ_data(data:bytes):
-    offset1 = 0
-    _data = data
-    while b'\xFD7zXZ\x00\x00\x01' in _data:
-        offset1 = offset1 + _data.index(b'\xFD7zXZ\x00\x00\x01') + 8
-        _data = _data[offset1:]
-    offset1 -= 8
-    offset2 = 0
-    _data = data
-    while b'\x00\x00\x00\x00\x01\x59\x5A' in _data:
-        offset2 = offset2 + _data.index(b'\x00\x00\x00\x00\x01\x59\x5A') + 7
-        _data = _data[offset2:]
+# xz stream header (magic + CRC32 stream flags) and footer tail (upper backward size bytes + flags + 'YZ')
+XZ_HEADER_MAGIC = b'\xFD7zXZ\x00\x00\x01'
+XZ_FOOTER_MAGIC = b'\x00\x00\x00\x00\x01\x59\x5A'
+
+def find_7zXZ_range(data:bytes):
+    offset1 = data.rfind(XZ_HEADER_MAGIC)
+    if offset1 < 0:
+        return 0,0
+    # the stream ends after its header, so only the bytes behind it need searching
+    offset2 = data.rfind(XZ_FOOTER_MAGIC,offset1+len(XZ_HEADER_MAGIC))
+    if offset2 < 0:
+        return 0,0
+    offset2 += len(XZ_FOOTER_MAGIC)
     print(f'found 7zXZ data offset:{offset1} size:{offset2-offset1}')
-    return data[offset1:offset2] 
+    return offset1,offset2
+
+def find_7zXZ_data(data:bytes):
+    offset1,offset2 = find_7zXZ_range(data)
+    return memoryview(data)[offset1:offset2]
 
 def patch_elf(data: bytes,key_dict:dict):
-    initrd_xz = find_7zXZ_data(data)
+    offset1,offset2 = find_7zXZ_range(data)
+    initrd_xz = memoryview(data)[offset1:offset2]
     new_initrd_xz =  patch_initrd_xz(initrd_xz,key_dict)
-    return data.replace(initrd_xz,new_initrd_xz)
+    if new_initrd_xz is initrd_xz:
+        return data
+    new_data = bytearray(data)
+    new_data[offset1:offset2] = new_initrd_xz
+    return new_data
 
 def patch_pe(data: bytes,key_dict:dict):
-    vmlinux_xz = find_7zXZ_data(data)
-    vmlinux = lzma.decompress(vmlinux_xz)
-    initrd_xz_offset = vmlinux.index(b'\xFD7zXZ\x00\x00\x01')
-    initrd_xz_size = vmlinux[initrd_xz_offset:].index(b'\x00\x00\x00\x00\x01\x59\x5A') + 7
-    initrd_xz = vmlinux[initrd_xz_offset:initrd_xz_offset+initrd_xz_size]
+    vmlinux_xz_offset,vmlinux_xz_end = find_7zXZ_range(data)
+    vmlinux_xz = memoryview(data)[vmlinux_xz_offset:vmlinux_xz_end]
+    vmlinux = decompress_vmlinux(vmlinux_xz)
+    initrd_xz_offset = vmlinux.index(XZ_HEADER_MAGIC)
+    initrd_xz_size = vmlinux.index(XZ_FOOTER_MAGIC,initrd_xz_offset) - initrd_xz_offset + len(XZ_FOOTER_MAGIC)
+    initrd_xz = memoryview(vmlinux)[initrd_xz_offset:initrd_xz_offset+initrd_xz_size]
     new_initrd_xz = patch_initrd_xz(initrd_xz,key_dict)  
-    new_vmlinux = vmlinux.replace(initrd_xz,new_initrd_xz)
-    new_vmlinux_xz = lzma.compress(new_vmlinux,check=lzma.CHECK_CRC32,filters=[{"id": lzma.FILTER_LZMA2, "preset": 9,}] )
+    if new_initrd_xz is initrd_xz:
+        return data
+    new_vmlinux = vmlinux[:initrd_xz_offset] + new_initrd_xz + vmlinux[initrd_xz_offset+initrd_xz_size:]
+    new_vmlinux_xz = xz_compress(new_vmlinux,len(vmlinux_xz),
+        [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": xz_dict_size(new_vmlinux)}],
+        [{"id": lzma.FILTER_LZMA2, "preset": 9,}])
     assert len(new_vmlinux_xz) <= len(vmlinux_xz),'new vmlinux xz size is too big'
     print(f'new vmlinux xz size:{len(new_vmlinux_xz)}')
     print(f'old vmlinux xz size:{len(vmlinux_xz)}')
     print(f'ljust size:{len(vmlinux_xz)-len(new_vmlinux_xz)}')
     new_vmlinux_xz = new_vmlinux_xz.ljust(len(vmlinux_xz),b'\0')
-    new_data = data.replace(vmlinux_xz,new_vmlinux_xz)
+    new_data = bytearray(data)
+    new_data[vmlinux_xz_offset:vmlinux_xz_end] = new_vmlinux_xz
     return new_data
 
+def patch_bootloader(name:str,data:bytes,key_dict:dict):
+    try:
+        if data[:2] == b'MZ':
+            return patch_pe(data,key_dict)
+        elif data[:4] == b'\x7FELF':
+            return patch_elf(data,key_dict)
+        else:
+            raise Exception(f'unknown bootloader format {data[:4].hex().upper()}')
+    except Exception as e:
+        print(f'patch {name} bootloader failed {e}')
+        return data
+
+def patch_bootloader_initrd(name:str,initrd_xz:bytes,key_dict:dict):
+    try:
+        return patch_initrd_xz(initrd_xz,key_dict)
+    except Exception as e:
+        print(f'patch {name} bootloader failed {e}')
+        return initrd_xz
+
+def patch_bootloaders(bootloaders:list,key_dict:dict):
+    # the workers do not share _INITRD_CACHE, so the initrds of ELF bootloaders are cut out here and
+    # every distinct one is patched once; PE bootloaders hide theirs inside the vmlinux and go whole
+    initrds = {}
+    spans = []
+    for name,data in bootloaders:
+        offset1,offset2 = find_7zXZ_range(data) if data[:4] == b'\x7FELF' else (0,0)
+        if offset2 > offset1:
+            initrd_xz = bytes(data[offset1:offset2])
+            initrds.setdefault(initrd_xz,name)
+            spans.append((offset1,offset2,initrd_xz))
+        else:
+            spans.append(None)
+    with ProcessPoolExecutor() as executor:
+        patched_initrds = {initrd_xz:executor.submit(patch_bootloader_initrd,name,initrd_xz,key_dict) for initrd_xz,name in initrds.items()}
+        futures = [executor.submit(patch_bootloader,name,data,key_dict) if span is None else None for (name,data),span in zip(bootloaders,spans)]
+        results = []
+        for (name,data),span,future in zip(bootloaders,spans,futures):
+            if span is None:
+                results.append(future.result())
+                continue
+            offset1,offset2,initrd_xz = span
+            new_initrd_xz = patched_initrds[initrd_xz].result()
+            if new_initrd_xz == initrd_xz:
+                results.append(data)
+            else:
+                new_data = bytearray(data)
+                new_data[offset1:offset2] = new_initrd_xz
+                results.append(new_data)
+    return results
+
 def patch_netinstall(key_dict: dict,input_file,output_file=None):
-    netinstall = open(input_file,'rb').read()
+    with open(input_file,'rb') as f:
+        # an empty file cannot be mapped, and it is neither of the formats below anyway
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        netinstall = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
     if netinstall[:2] == b'MZ':
+        netinstall.close()
         from package import check_install_package
         check_install_package(['pefile'])
         import pefile
@@ -171,6 +341,7 @@ def patch_netinstall(key_dict: dict,input_file,output_file=None):
             143:{'arch':'x86_64','name':'x86_64boot'}
         }
         with pefile.PE(input_file) as pe:
+            bootloaders = []
             for resource in pe.DIRECTORY_ENTRY_RESOURCE.entries:
                 if resource.id == pefile.RESOURCE_TYPE["RT_RCDATA"]:
                     for sub_resource in resource.directory.entries:
@@ -182,22 +353,16 @@ def patch_netinstall(key_dict: dict,input_file,output_file=None):
                             data = pe.get_data(rva,size)
                             _size = struct.unpack('<I',data[:4])[0]
                             _data = data[4:4+_size]
-                            try:
-                                if _data[:2] == b'MZ':
-                                    new_data = patch_pe(_data,key_dict)
-                                elif _data[:4] == b'\x7FELF':
-                                    new_data = patch_elf(_data,key_dict)
-                                else:
-                                    raise Exception(f'unknown bootloader format {_data[:4].hex().upper()}')
-                            except Exception as e:
-                                print(f'patch {bootloader["arch"]}({sub_resource.id}) bootloader failed {e}')
-                                new_data = _data
-                            new_data = struct.pack("<I",_size) + new_data.ljust(len(_data),b'\0')
-                            new_data = new_data.ljust(size,b'\0')
-                            pe.set_bytes_at_rva(rva,new_data)
+                            bootloaders.append((f'{bootloader["arch"]}({sub_resource.id})',rva,size,_size,_data))
+            results = patch_bootloaders([(b[0],b[4]) for b in bootloaders],key_dict)
+            for (_,rva,size,_size,_data),new_data in zip(bootloaders,results):
+                if new_data == _data:
+                    continue
+                new_data = struct.pack("<I",_size) + new_data.ljust(len(_data),b'\0')
+                new_data = new_data.ljust(size,b'\0')
+                pe.set_bytes_at_rva(rva,new_data)
             pe.write(output_file or input_file)
     elif netinstall[:4] == b'\x7FELF':
-        import re
         # 83 00 00 00 C4 68 C4 0B  5A C2 04 08 10 9E 52 00
         # 8A 00 00 00 C3 68 C4 0B  6A 60 57 08 C0 3D 54 00
         # 81 00 00 00 D3 68 C4 0B  2A 9E AB 08 5C 1B 78 00
@@ -208,43 +373,64 @@ def patch_netinstall(key_dict: dict,input_file,output_file=None):
         # 8C 00 00 00 F1 6B C4 0B  2E 2D BE 0A 78 EA 5D 00
         # 88 00 00 00 03 69 C4 0B  A6 17 1C 0B 28 55 4A 00
         # 8F 00 00 00 FC 6B C4 0B  CE 6C 66 0B E0 E8 58 00
-        SECTION_HEADER_OFFSET_IN_FILE = struct.unpack_from(b'<I',netinstall[0x20:])[0]
-        SECTION_HEADER_ENTRY_SIZE = struct.unpack_from(b'<H',netinstall[0x2E:])[0]
-        NUMBER_OF_SECTION_HEADER_ENTRIES = struct.unpack_from(b'<H',netinstall[0x30:])[0]
-        STRING_TABLE_INDEX = struct.unpack_from(b'<H',netinstall[0x32:])[0]
+        SECTION_HEADER_OFFSET_IN_FILE = struct.unpack_from(b'<I',netinstall,0x20)[0]
+        SECTION_HEADER_ENTRY_SIZE = struct.unpack_from(b'<H',netinstall,0x2E)[0]
+        NUMBER_OF_SECTION_HEADER_ENTRIES = struct.unpack_from(b'<H',netinstall,0x30)[0]
+        STRING_TABLE_INDEX = struct.unpack_from(b'<H',netinstall,0x32)[0]
         section_name_offset = SECTION_HEADER_OFFSET_IN_FILE + STRING_TABLE_INDEX * SECTION_HEADER_ENTRY_SIZE + 16
-        SECTION_NAME_BLOCK = struct.unpack_from(b'<I',netinstall[section_name_offset:])[0]
+        SECTION_NAME_BLOCK = struct.unpack_from(b'<I',netinstall,section_name_offset)[0]
         for i in range(NUMBER_OF_SECTION_HEADER_ENTRIES):
             section_offset = SECTION_HEADER_OFFSET_IN_FILE + i * SECTION_HEADER_ENTRY_SIZE
-            name_offset,_,_,addr,offset = struct.unpack_from('<IIIII',netinstall[section_offset:])
-            name = netinstall[SECTION_NAME_BLOCK+name_offset:].split(b'\0')[0]
+            name_offset,_,_,addr,offset = struct.unpack_from('<IIIII',netinstall,section_offset)
+            name_start = SECTION_NAME_BLOCK+name_offset
+            name = netinstall[name_start:netinstall.find(b'\0',name_start)]
             if name == b'.text':
                 print(f'found .text section at {hex(offset)} addr {hex(addr)}')
                 text_section_addr = addr
                 text_section_offset = offset
                 break
-        offset = re.search(rb'\x83\x00\x00\x00.{12}\x8A\x00\x00\x00.{12}\x81\x00\x00\x00.{12}',netinstall).start()
+        offset = find_bootloader_table(netinstall)
         print(f'found bootloaders offset {hex(offset)}')
+        bootloaders = []
         for i in range(10):
-            id,name_ptr,data_ptr,data_size = struct.unpack_from('<IIII',netinstall[offset+i*16:offset+i*16+16])
-            name = netinstall[text_section_offset+name_ptr-text_section_addr:].split(b'\0')[0]
-            data = netinstall[text_section_offset+data_ptr-text_section_addr:text_section_offset+data_ptr-text_section_addr+data_size]
-            print(f'found {name.decode()}({id}) bootloader offset {hex(text_section_offset+data_ptr-text_section_addr)} size {data_size}')
-            try:
-                if data[:2] == b'MZ':
-                    new_data = patch_pe(data,key_dict)
-                elif data[:4] == b'\x7FELF':
-                    new_data = patch_elf(data,key_dict)
-                else:
-                    raise Exception(f'unknown bootloader format {data[:4].hex().upper()}')
-            except Exception as e:
-                print(f'patch {name.decode()}({id}) bootloader failed {e}')
-                new_data = data
-            new_data = new_data.ljust(len(data),b'\0')
-            netinstall = netinstall.replace(data,new_data)
-        open(output_file or input_file,'wb').write(netinstall)
+            id,name_ptr,data_ptr,data_size = struct.unpack_from('<IIII',netinstall,offset+i*16)
+            name_start = text_section_offset+name_ptr-text_section_addr
+            name = netinstall[name_start:netinstall.find(b'\0',name_start)]
+            data_offset = text_section_offset+data_ptr-text_section_addr
+            data = netinstall[data_offset:data_offset+data_size]
+            print(f'found {name.decode()}({id}) bootloader offset {hex(data_offset)} size {data_size}')
+            bootloaders.append((f'{name.decode()}({id})',data_offset,data))
+        netinstall.close()
+        patches = []
+        results = patch_bootloaders([(b[0],b[2]) for b in bootloaders],key_dict)
+        for (_,data_offset,data),new_data in zip(bootloaders,results):
+            # bootloaders without keys come back unchanged (possibly as a copy, from a worker) and are not rewritten
+            if new_data != data:
+                patches.append((data_offset,new_data.ljust(len(data),b'\0')))
+        if output_file and os.path.abspath(output_file) != os.path.abspath(input_file):
+            shutil.copyfile(input_file,output_file)
+        with open(output_file or input_file,'r+b') as f:
+            for data_offset,new_data in patches:
+                f.seek(data_offset)
+                f.write(new_data)
+    else:
+        netinstall.close()
+
+# (hash of the original kernel, key pairs) -> patched kernel
+_KERNEL_CACHE = {}
 
 def patch_kernel(data:bytes,key_dict):
+    # x86 packages ship the same bzImage as both BOOTX64.EFI and boot/kernel
+    cache_key = (_cache_hash(data).digest(),tuple(key_dict.items()))
+    if cache_key not in _KERNEL_CACHE:
+        new_data = _patch_kernel(data,key_dict)
+        # None marks a kernel without keys, so callers still get their own object back
+        _KERNEL_CACHE[cache_key] = None if new_data is data else new_data
+    else:
+        print('kernel already patched, reusing result')
+    return _KERNEL_CACHE[cache_key] or data
+
+def _patch_kernel(data:bytes,key_dict):
     if data[:2] == b'MZ':
         print('patching EFI Kernel')
         if data[56:60] == b'ARM\x64':
@@ -262,67 +448,139 @@ def patch_kernel(data:bytes,key_dict):
     else:
         raise Exception('unknown kernel format')
 
+def patch_squashfs_file(file,key_dict,url_dict,renew_url_dict):
+    # runs in a worker process; messages are returned so the parent prints them whole and in order
+    logs = []
+    url_dict = url_dict | renew_url_dict if os.path.split(file)[1] == 'licupgr' else url_dict
+    with open(file,'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return logs
+        with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+            # most files match nothing; a split key still starts with its first 4 bytes verbatim
+            needles = [old_public_key[:4] for old_public_key in key_dict] + list(url_dict)
+            if all(mm.find(needle) < 0 for needle in needles):
+                return logs
+            buf = bytearray(mm)
+    patched,spans = patch_many(buf,key_dict,url_dict,log=logs.append)
+    if not patched and not spans:
+        return logs
+    patched_urls = set()
+    chunks = []
+    offset = 0
+    for start,end,new_url in spans:
+        patched_urls.add(bytes(buf[start:end]))
+        chunks.append(memoryview(buf)[offset:start])
+        chunks.append(new_url)
+        offset = end
+    chunks.append(memoryview(buf)[offset:])
+    for old_url in url_dict:
+        if old_url in patched_urls:
+            logs.append(f'{file} url patched {old_url.decode()[:7]}...')
+    with open(file,'wb') as f:
+        f.writelines(chunks)
+    return logs
+
+def grep_files(path,needles):
+    # grep looks for all literals in one pass over the tree; None means every file has to be scanned
+    if shutil.which('grep') is None or any(b'\n' in needle for needle in needles):
+        return None
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(b'\n'.join(needles))
+        f.flush()
+        process = subprocess.run(['grep','-rlaFZ','-f',f.name,'--',path],stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,env={**os.environ,'LC_ALL':'C'})
+    if process.returncode > 1:
+        return None
+    return [os.fsdecode(file) for file in process.stdout.split(b'\0') if file]
+
 def patch_squashfs(path,key_dict):
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            file = os.path.join(root,file)
-            if os.path.isfile(file):
-                data = open(file,'rb').read()
-                for old_public_key,new_public_key in key_dict.items():
-                    _data = replace_key(old_public_key,new_public_key,data)
-                    if _data != data:
-                        open(file,'wb').write(_data)
-                url_dict = {
-                    os.environ['MIKRO_LICENCE_URL'].encode():os.environ['CUSTOM_LICENCE_URL'].encode(),
-                    os.environ['MIKRO_UPGRADE_URL'].encode():os.environ['CUSTOM_UPGRADE_URL'].encode(),
-                    os.environ['MIKRO_CLOUD_URL'].encode():os.environ['CUSTOM_CLOUD_URL'].encode(),
-                    os.environ['MIKRO_CLOUD_PUBLIC_KEY'].encode():os.environ['CUSTOM_CLOUD_PUBLIC_KEY'].encode(),
-                }
-                data = open(file,'rb').read()
-                for old_url,new_url in url_dict.items():
-                    if old_url in data:
-                        print(f'{file} url patched {old_url.decode()[:7]}...')
-                        data = data.replace(old_url,new_url)
-                        open(file,'wb').write(data)
-                        
-                if os.path.split(file)[1] == 'licupgr':
-                    url_dict = {
-                        os.environ['MIKRO_RENEW_URL'].encode():os.environ['CUSTOM_RENEW_URL'].encode(),
-                    }
-                    for old_url,new_url in url_dict.items():
-                        if old_url in data:
-                            print(f'{file} url patched {old_url.decode()[:7]}...')
-                            data = data.replace(old_url,new_url)
-                            open(file,'wb').write(data)
+    url_dict = {
+        os.environ['MIKRO_LICENCE_URL'].encode():os.environ['CUSTOM_LICENCE_URL'].encode(),
+        os.environ['MIKRO_UPGRADE_URL'].encode():os.environ['CUSTOM_UPGRADE_URL'].encode(),
+        os.environ['MIKRO_CLOUD_URL'].encode():os.environ['CUSTOM_CLOUD_URL'].encode(),
+        os.environ['MIKRO_CLOUD_PUBLIC_KEY'].encode():os.environ['CUSTOM_CLOUD_PUBLIC_KEY'].encode(),
+    }
+    renew_url_dict = {
+        os.environ['MIKRO_RENEW_URL'].encode():os.environ['CUSTOM_RENEW_URL'].encode(),
+    }
+    # an unset url is an empty string, which would match everywhere
+    url_dict = {old:new for old,new in url_dict.items() if old}
+    renew_url_dict = {old:new for old,new in renew_url_dict.items() if old}
+    needles = [old_public_key[:4] for old_public_key in key_dict] + list(url_dict) + list(renew_url_dict)
+    files = grep_files(path,needles)
+    if files is None:
+        files = [os.path.join(root,file) for root,dirs,files in os.walk(path) for file in files]
+    # symlinks are skipped: their targets are visited on their own, and two workers must not rewrite the same file
+    files = [file for file in files if os.path.isfile(file) and not os.path.islink(file)]
+    # every file is patched independently, so the tree is spread over all cores
+    with ProcessPoolExecutor() as executor:
+        for logs in executor.map(patch_squashfs_file,files,repeat(key_dict),repeat(url_dict),repeat(renew_url_dict),chunksize=32):
+            for line in logs:
+                print(line)
                     
 def run_shell_command(command):
-    process = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # an argv list runs the program directly; only a string goes through /bin/sh
+    process = subprocess.run(command, shell=isinstance(command,str), check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return process.stdout, process.stderr
 
 def patch_npk_package(package,key_dict):
-    if package[NpkPartID.NAME_INFO].data.name == 'system':
-        file_container = NpkFileContainer.unserialize_from(package[NpkPartID.FILE_CONTAINER].data)
-        for item in file_container:
-            if item.name in [b'boot/EFI/BOOT/BOOTX64.EFI',b'boot/kernel',b'boot/initrd.rgz']:
-                print(f'patch {item.name} ...')
-                item.data = patch_kernel(item.data,key_dict)
-        package[NpkPartID.FILE_CONTAINER].data = file_container.serialize()
-        squashfs_file = 'squashfs-root.sfs'
-        extract_dir = 'squashfs-root'
-        open(squashfs_file,'wb').write(package[NpkPartID.SQUASHFS].data)
-        print(f"extract {squashfs_file} ...")
-        run_shell_command(f"unsquashfs -d {extract_dir} {squashfs_file}")
-        patch_squashfs(extract_dir,key_dict)
-        logo = os.path.join(extract_dir,"nova/lib/console/logo.txt")
-        run_shell_command(f"sudo sed -i '1d' {logo}") 
-        run_shell_command(f"sudo sed -i '8s#.*#  elseif@live.cn     https://github.com/elseif/MikroTikPatch#' {logo}")
-        print(f"pack {extract_dir} ...")
-        run_shell_command(f"rm -f {squashfs_file}")
-        run_shell_command(f"mksquashfs {extract_dir} {squashfs_file} -quiet -comp xz -no-xattrs -b 256k")
-        print(f"clean ...")
-        run_shell_command(f"rm -rf {extract_dir}")
-        package[NpkPartID.SQUASHFS].data = open(squashfs_file,'rb').read()
-        run_shell_command(f"rm -f {squashfs_file}")
+    if package[NpkPartID.NAME_INFO].parsed.name == 'system':
+        container,spans = NpkFileContainer.locate(package[NpkPartID.FILE_CONTAINER].data)
+        kernels = {}
+        for name in [b'boot/EFI/BOOT/BOOTX64.EFI',b'boot/kernel',b'boot/initrd.rgz']:
+            if name in spans:
+                start,end = spans[name]
+                print(f'patch {name} ...')
+                kernels[name] = bytes(container[start:end])
+        # lzma releases the GIL, so the kernels are re-encoded concurrently;
+        # identical kernels are submitted once so they still share one result
+        with ThreadPoolExecutor() as executor:
+            futures = {kernel:executor.submit(patch_kernel,kernel,key_dict) for kernel in set(kernels.values())}
+        patched = {}
+        for name,kernel in kernels.items():
+            data = futures[kernel].result()
+            # the patchers hand back their input when no key was found;
+            # identical kernels share one input object, so compare by value
+            if data != kernel:
+                patched[name] = data
+        if all(len(data) == spans[name][1]-spans[name][0] for name,data in patched.items()):
+            # the patchers keep sizes by padding, so the items can be overwritten where they are
+            for name,data in patched.items():
+                start,end = spans[name]
+                container[start:end] = data
+            if patched:
+                package[NpkPartID.FILE_CONTAINER].data = NpkFileContainer.pack(container)
+        else:
+            file_container = NpkFileContainer.unserialize_from(package[NpkPartID.FILE_CONTAINER].data)
+            for item in file_container:
+                if item.name in patched:
+                    item.data = patched[item.name]
+            package[NpkPartID.FILE_CONTAINER].data = file_container.serialize()
+        # the image is unpacked and repacked in RAM when a tmpfs is available
+        workdir = tempfile.mkdtemp(prefix='squashfs-',dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        try:
+            squashfs_file = os.path.join(workdir,'squashfs-root.sfs')
+            extract_dir = os.path.join(workdir,'squashfs-root')
+            with open(squashfs_file,'wb') as f:
+                f.write(memoryview(package[NpkPartID.SQUASHFS].data))
+            print(f"extract {squashfs_file} ...")
+            run_shell_command(["unsquashfs","-processors",str(os.cpu_count()),"-d",extract_dir,squashfs_file])
+            patch_squashfs(extract_dir,key_dict)
+            logo = os.path.join(extract_dir,"nova/lib/console/logo.txt")
+            run_shell_command(["sudo","sed","-i","1d",logo]) 
+            run_shell_command(["sudo","sed","-i","8s#.*#  elseif@live.cn     https://github.com/elseif/MikroTikPatch#",logo])
+            print(f"pack {extract_dir} ...")
+            os.remove(squashfs_file)
+            run_shell_command(["mksquashfs",extract_dir,squashfs_file,"-quiet","-comp","xz","-no-xattrs","-b","256k","-processors",str(os.cpu_count())])
+            print(f"clean ...")
+            shutil.rmtree(extract_dir)
+            # read straight into a buffer of the final size instead of a growing one
+            squashfs = bytearray(os.path.getsize(squashfs_file))
+            with open(squashfs_file,'rb') as f:
+                f.readinto(squashfs)
+            package[NpkPartID.SQUASHFS].data = squashfs
+        finally:
+            # the work directory may live in RAM, so it goes away even when a step fails
+            shutil.rmtree(workdir,ignore_errors=True)
 
 def patch_npk_file(key_dict,kcdsa_private_key,eddsa_private_key,input_file,output_file=None):
     npk = NovaPackage.load(input_file)   
@@ -355,6 +613,10 @@ if __name__ == '__main__':
         bytes.fromhex(os.environ['MIKRO_LICENSE_PUBLIC_KEY']):bytes.fromhex(os.environ['CUSTOM_LICENSE_PUBLIC_KEY']),
         bytes.fromhex(os.environ['MIKRO_NPK_SIGN_PUBLIC_KEY']):bytes.fromhex(os.environ['CUSTOM_NPK_SIGN_PUBLIC_KEY'])
     }
+    # keys are overwritten in place, a replacement of another size would shift everything after it
+    for old_key,new_key in key_dict.items():
+        if len(old_key) != len(new_key):
+            raise Exception(f'public key {new_key.hex().upper()} is {len(new_key)} bytes, expected {len(old_key)}')
     kcdsa_private_key = bytes.fromhex(os.environ['CUSTOM_LICENSE_PRIVATE_KEY'])
     eddsa_private_key = bytes.fromhex(os.environ['CUSTOM_NPK_SIGN_PRIVATE_KEY'])
     if args.command =='npk':
@@ -362,8 +624,10 @@ if __name__ == '__main__':
         patch_npk_file(key_dict,kcdsa_private_key,eddsa_private_key,args.input,args.output)
     elif args.command == 'kernel':
         print(f'patching {args.input} ...')
-        data = patch_kernel(open(args.input,'rb').read(),key_dict)
-        open(args.output or args.input,'wb').write(data)
+        with open(args.input,'rb') as f:
+            data = patch_kernel(f.read(),key_dict)
+        with open(args.output or args.input,'wb') as f:
+            f.write(data)
     elif args.command == 'block':
         print(f'patching {args.file} in {args.dev} ...')
         patch_block(args.dev,args.file,key_dict)
@@ -26,20 +26,27 @@
 import binascii
 import codecs
 import collections
+import functools
+import hashlib
+import operator
 import struct
 import sys
 
 if sys.version > '3':
     long = int
 
+MASK32 = 0xffffffff
 
-class SHA256(object):
+
+class PySHA256(object):
     """
     SHA256 (FIPS 180-3) implementation for experimentation.
 
     This is an implementation of the hash function designed not for
     efficiency, but for clarity and ability to experiment.  The details
-    of the algorithm are abstracted out with subclassing in mind.
+    of the algorithm are abstracted out with subclassing in mind.  Use
+    SHA256 when only the digest is needed, and TracedSHA256 to hook
+    individual operations.
 
     """
 
@@ -72,38 +79,31 @@ class SHA256(object):
         0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
     )
 
-    # Abstract bitwise operations, which can be overridden to provide tracing
-    # or alternate implementations:
+    # Modular addition; the primitive bitwise operations are only hooks in
+    # TracedSHA256:
     @staticmethod
     def _sum_mod32(*args):
-        return sum(args) & 0xffffffff
-    @classmethod
-    def _xor(cls, *args):
-        if len(args) == 2:
-            return args[0] ^ args[1]
-        else:
-            return args[0] ^ cls._xor(*args[1:])
-    _and = staticmethod(lambda x, y: x & y)
-    _invert = staticmethod(lambda x: ~x)
+        return sum(args) & MASK32
 
-    # Operations defined by FIPS 180-3 section 3.2 (page 8):
-    _rrot = staticmethod(lambda x, n: ((x & 0xffffffff) >> n) | (x << (32 - n)) & 0xffffffff)
-    _shr = staticmethod(lambda x, n: (x & 0xffffffff) >> n)
+    # Operations defined by FIPS 180-3 section 3.2 (page 8).  Inputs are
+    # always 32-bit words, so only the left shift needs masking:
+    _rrot = staticmethod(lambda x, n: (x >> n) | ((x << (32 - n)) & MASK32))
+    _shr = staticmethod(lambda x, n: x >> n)
 
     # Operations defined by FIPS 180-3 section 4.1.2 (page 10):
-    _ch = classmethod(lambda cls, x, y, z: cls._xor(cls._and(x, y), cls._and(cls._invert(x), z)))
-    _maj = classmethod(lambda cls, x, y, z: cls._xor(cls._and(x, y), cls._and(x, z), cls._and(y, z)))
-    _S0 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 2), cls._rrot(x, 13), cls._rrot(x, 22)))
-    _S1 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 6), cls._rrot(x, 11), cls._rrot(x, 25)))
-    _s0 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 7), cls._rrot(x, 18), cls._shr(x, 3)))
-    _s1 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 17), cls._rrot(x, 19), cls._shr(x, 10)))
+    _ch = staticmethod(lambda x, y, z: (x & y) ^ (~x & z))
+    _maj = staticmethod(lambda x, y, z: (x & y) ^ (x & z) ^ (y & z))
+    _S0 = classmethod(lambda cls, x: cls._rrot(x, 2) ^ cls._rrot(x, 13) ^ cls._rrot(x, 22))
+    _S1 = classmethod(lambda cls, x: cls._rrot(x, 6) ^ cls._rrot(x, 11) ^ cls._rrot(x, 25))
+    _s0 = classmethod(lambda cls, x: cls._rrot(x, 7) ^ cls._rrot(x, 18) ^ cls._shr(x, 3))
+    _s1 = classmethod(lambda cls, x: cls._rrot(x, 17) ^ cls._rrot(x, 19) ^ cls._shr(x, 10))
 
     # Operations defined by FIPS 180-3 section 6.2.2 (page 22):
     _T1 = classmethod(lambda cls, prev, w, k: cls._sum_mod32(cls._S1(prev.e), cls._ch(prev.e, prev.f, prev.g), prev.h, w, k))
     _T2 = classmethod(lambda cls, prev: cls._sum_mod32(cls._S0(prev.a), cls._maj(prev.a, prev.b, prev.c)))
 
     @classmethod
-    def _round(cls, number, w, prev=INITIAL_STATE):
+    def _round(cls, number, w, prev=INITIAL_STATE, k_index=None):
         """
         Performs one round of SHA256 message transformation, returning the new
         message state.  See FIPS 180-3 section 6.2.2 step 3 (pages 21-22).
@@ -117,9 +117,13 @@ class SHA256(object):
         :param prev:
             Named tuple containing the working state from the previous round.
 
+        :param k_index:
+            The round's index within its block, if the caller knows it.
+            Otherwise it is derived from *number*.
+
         """
 
-        t1 = cls._T1(prev, w, cls.K[number % 64])
+        t1 = cls._T1(prev, w, cls.K[number % 64 if k_index is None else k_index])
         return cls.State(
             a=cls._sum_mod32(t1, cls._T2(prev)),
             b=prev.a,
@@ -170,9 +174,15 @@ class SHA256(object):
 
         assert len(message) == 16, '_expand_message() got %d words, expected 16' % len(message)
 
+        # _s0() and _s1() written out inline; TracedSHA256 goes through the
+        # operation hooks instead.
         w = list(message)
         for i in range(16, 64):
-            w.append(cls._sum_mod32(w[i - 16], cls._s0(w[i - 15]), w[i - 7], cls._s1(w[i - 2])))
+            x = w[i - 15]
+            y = w[i - 2]
+            s0 = ((x >> 7 | x << 25) ^ (x >> 18 | x << 14) ^ (x >> 3)) & 0xffffffff
+            s1 = ((y >> 17 | y << 15) ^ (y >> 19 | y << 13) ^ (y >> 10)) & 0xffffffff
+            w.append((w[i - 16] + s0 + w[i - 7] + s1) & 0xffffffff)
 
         return w
 
@@ -190,9 +200,8 @@ class SHA256(object):
             The digest state from the previous block.
 
         :param round_offset:
-            The _round() method can be overridden to report intermediate hash
-            values, in which case it's useful to know how many rounds came
-            before.  This argument allows the caller to specify as much.
+            The number of rounds that came before.  Only TracedSHA256 passes
+            it on to _round(); it is accepted here for the same signature.
 
         """
 
@@ -201,11 +210,29 @@ class SHA256(object):
 
         w = cls._expand_message(struct.unpack('>LLLLLLLLLLLLLLLL', message))
 
-        midstate = state
-        for i in range(64):
-            midstate = cls._round(round_offset + i, w[i], midstate)
+        # _round() and _finalize() written out inline, with the working state
+        # in locals rather than a new State per round.
+        a, b, c, d, e, f, g, h = state
+        for k, wi in zip(cls.K, w):
+            S1 = ((e >> 6 | e << 26) ^ (e >> 11 | e << 21) ^ (e >> 25 | e << 7)) & 0xffffffff
+            t1 = h + S1 + ((e & f) ^ (~e & g)) + k + wi
+            S0 = ((a >> 2 | a << 30) ^ (a >> 13 | a << 19) ^ (a >> 22 | a << 10)) & 0xffffffff
+            t2 = S0 + ((a & b) ^ (a & c) ^ (b & c))
+            h = g
+            g = f
+            f = e
+            e = (d + t1) & 0xffffffff
+            d = c
+            c = b
+            b = a
+            a = (t1 + t2) & 0xffffffff
 
-        return cls._finalize(midstate, state)
+        return cls.State(
+            (state.a + a) & 0xffffffff, (state.b + b) & 0xffffffff,
+            (state.c + c) & 0xffffffff, (state.d + d) & 0xffffffff,
+            (state.e + e) & 0xffffffff, (state.f + f) & 0xffffffff,
+            (state.g + g) & 0xffffffff, (state.h + h) & 0xffffffff
+        )
 
     @classmethod
     def _pad_message(cls, message, length):
@@ -267,7 +294,7 @@ class SHA256(object):
 
         self.state = self.INITIAL_STATE
         self.length = long(0)
-        self.buffer = b''
+        self.buffer = bytearray()
         self.round_offset = round_offset
 
         self.update(message)
@@ -285,14 +312,27 @@ class SHA256(object):
 
         """
 
-        message = bytes(message)
+        message = memoryview(bytes(message))
         self.length += len(message) * 8
-        self.buffer = b''.join((self.buffer, message))
+        offset = 0
+
+        # Top up a partial block left over from the previous call first
+        if self.buffer:
+            offset = min(64 - len(self.buffer), len(message))
+            self.buffer += message[:offset]
+            if len(self.buffer) < 64:
+                return
+            self.state = self._process_block(bytes(self.buffer), self.state, self.round_offset)
+            self.round_offset += 64
 
-        while len(self.buffer) >= 64:
-            self.state = self._process_block(self.buffer[:64], self.state, self.round_offset)
-            self.buffer = self.buffer[64:]
+        # Whole blocks are hashed straight out of the message, only the tail
+        # is copied into the buffer
+        while offset + 64 <= len(message):
+            self.state = self._process_block(message[offset:offset + 64], self.state, self.round_offset)
             self.round_offset += 64
+            offset += 64
+
+        self.buffer = bytearray(message[offset:])
 
     def digest(self):
         """
@@ -314,4 +354,130 @@ class SHA256(object):
     def hexdigest(self):
         """Like digest(), but returns a hexadecimal string."""
 
-        return binascii.hexlify(self.digest())
\ No newline at end of file
+        return binascii.hexlify(self.digest())
+
+
+class TracedSHA256(PySHA256):
+    """
+    PySHA256 with every step routed through the overridable operation hooks.
+
+    PySHA256 inlines the hot paths, so overriding e.g. _xor() or _rrot()
+    there has no effect on the digest.  Subclass this instead to trace or
+    replace individual operations.
+
+    """
+
+    # Abstract bitwise operations, which can be overridden to provide tracing
+    # or alternate implementations:
+    @staticmethod
+    def _xor(*args):
+        return functools.reduce(operator.xor, args)
+    _and = staticmethod(lambda x, y: x & y)
+    _invert = staticmethod(lambda x: ~x)
+
+    # Operations defined by FIPS 180-3 section 4.1.2 (page 10), in terms of
+    # the hooks above:
+    _ch = classmethod(lambda cls, x, y, z: cls._xor(cls._and(x, y), cls._and(cls._invert(x), z)))
+    _maj = classmethod(lambda cls, x, y, z: cls._xor(cls._and(x, y), cls._and(x, z), cls._and(y, z)))
+    _S0 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 2), cls._rrot(x, 13), cls._rrot(x, 22)))
+    _S1 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 6), cls._rrot(x, 11), cls._rrot(x, 25)))
+    _s0 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 7), cls._rrot(x, 18), cls._shr(x, 3)))
+    _s1 = classmethod(lambda cls, x: cls._xor(cls._rrot(x, 17), cls._rrot(x, 19), cls._shr(x, 10)))
+
+    @classmethod
+    def _expand_message(cls, message):
+        """
+        Returns a list of 64 32-bit words based upon 16 32-bit words from the
+        message block being hashed.  See FIPS 180-3 section 6.2.2 step 1
+        (page 21).
+
+        :param message:
+            Array of 16 32-bit values (512 bits total).
+
+        """
+
+        assert len(message) == 16, '_expand_message() got %d words, expected 16' % len(message)
+
+        w = list(message)
+        for i in range(16, 64):
+            w.append(cls._sum_mod32(w[i - 16], cls._s0(w[i - 15]), w[i - 7], cls._s1(w[i - 2])))
+
+        return w
+
+    @classmethod
+    def _process_block(cls, message, state=PySHA256.INITIAL_STATE, round_offset=0):
+        """
+        Processes a block of message data, returning the new digest state
+        (the intermediate hash value).  See FIPS 180-3 section 6.2.2 (pages
+        21 and 22).
+
+        :param message:
+            Byte string of length 64 containing the block data to hash.
+
+        :param state:
+            The digest state from the previous block.
+
+        :param round_offset:
+            The _round() method can be overridden to report intermediate hash
+            values, in which case it's useful to know how many rounds came
+            before.  This argument allows the caller to specify as much.
+
+        """
+
+        assert len(message) == 64, '_process_block() got %d bytes, expected 64' % len(message)
+        assert not round_offset % 64, 'round_offset should be a multiple of 64'
+
+        w = cls._expand_message(struct.unpack('>LLLLLLLLLLLLLLLL', message))
+
+        midstate = state
+        for i in range(64):
+            midstate = cls._round(round_offset + i, w[i], midstate, i)
+
+        return cls._finalize(midstate, state)
+
+
+class SHA256(object):
+    """
+    SHA256 with the same interface as PySHA256, backed by hashlib.
+
+    Subclass PySHA256 instead to change constants or observe rounds.
+
+    """
+
+    def __init__(self, message=b''):
+        """
+        Constructor.
+
+        :param message:
+            Initial data to pass to update().
+
+        """
+
+        self._hash = hashlib.sha256()
+        self.update(message)
+
+    def update(self, message):
+        """
+        Updates the hash with the contents of *message*.
+
+        :param message:
+            A byte string to digest.
+
+        """
+
+        self._hash.update(message)
+
+    def digest(self):
+        """
+        Returns the SHA256 digest of the message.
+
+        As with PySHA256, update() can safely be used again after digest().
+
+        """
+
+        return self._hash.digest()
+
+    def hexdigest(self):
+        """Like digest(), but returns a hexadecimal string."""
+
+        return binascii.hexlify(self.digest())
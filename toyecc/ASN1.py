@@ -158,6 +158,12 @@ try:
 		"""For F_P fields, the field parameters is just the integer P."""
 		pass
 
+	# Decoding never modifies the spec, so one instance of each is shared by
+	# all parse calls instead of building the type tree every time.
+	_FIELD_FP_PARAMETERS_SPEC = FieldFPParameters()
+	_EC_PUBLIC_KEY_SPEC = ECPublicKey()
+	_EC_PRIVATE_KEY_SPEC = ECPrivateKey()
+
 	__have_asn1 = True
 except ImportError:
 	__have_asn1 = False
@@ -172,17 +178,17 @@ def __assert_asn1_support():
 def parse_asn1_field_params_fp(derdata):
 	"""Parse an ASN.1 DER encoded field parameter for fields in F_P."""
 	__assert_asn1_support()
-	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = FieldFPParameters())
+	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = _FIELD_FP_PARAMETERS_SPEC)
 	return parsed
 
 def parse_asn1_public_key(derdata):
 	"""Parse an ASN.1 DER encoded EC public key."""
 	__assert_asn1_support()
-	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = ECPublicKey())
+	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = _EC_PUBLIC_KEY_SPEC)
 	return parsed
 
 def parse_asn1_private_key(derdata):
 	"""Parse an ASN.1 DER encoded EC private key."""
 	__assert_asn1_support()
-	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = ECPrivateKey())
+	(parsed, tail) = pyasn1.codec.ber.decoder.decode(derdata, asn1Spec = _EC_PRIVATE_KEY_SPEC)
 	return parsed
@@ -48,6 +48,8 @@ class AffineCurvePoint(PointOpEDDSAEncoding, PointOpCurveConversion, PointOpNaiv
 			self._x = FieldElement(x, curve.p)
 			self._y = FieldElement(y, curve.p)
 		self._curve = curve
+		# Points are immutable, so the hash only needs to be computed once
+		self._hash = hash((self._x, self._y))
 
 	@staticmethod
 	def neutral(curve):
@@ -93,24 +95,123 @@ class AffineCurvePoint(PointOpEDDSAEncoding, PointOpCurveConversion, PointOpNaiv
 		assert(isinstance(scalar, int))
 		assert(scalar >= 0)
 
-		result = self.curve.neutral()
-		n = self
-		if scalar > 0:
-			for bit in range(scalar.bit_length()):
-				if (scalar & (1 << bit)):
-					result = result + n
-				n = n + n
+		# Montgomery ladder: every bit costs exactly one addition and one
+		# doubling, regardless of its value. The invariant R1 = R0 + self
+		# holds after every step. The ladder always runs over at least the
+		# bit length of the field so the loop count does not depend on the
+		# scalar either.
+		# The ladder runs on integer coordinates, only the result is wrapped
+		# into a point again.
+		curve = self.curve
+		add = curve.point_addition_raw
+		neutral = curve.neutral()
+		r0 = (None, None) if neutral.x is None else (int(neutral.x), int(neutral.y))
+		r1 = (None, None) if self.x is None else (int(self.x), int(self.y))
+		for bit in reversed(range(max(scalar.bit_length(), curve.p.bit_length()))):
+			if (scalar >> bit) & 1:
+				(r0, r1) = (add(*r0, *r1), add(*r1, *r1))
+			else:
+				(r0, r1) = (add(*r0, *r0), add(*r0, *r1))
+		result = AffineCurvePoint(*r0, curve)
 		#assert(result.oncurve())
 		return result
 
+	def mul_window(self, scalar, w = 5):
+		"""Returns the scalar point multiplication using the width-w
+		non-adjacent form (w-NAF) of the scalar. Only every (w + 1)th digit is
+		nonzero on average, so this needs far fewer point additions than the
+		ladder used for the multiplication operator. Note that, unlike that
+		ladder, the sequence of operations depends on the scalar."""
+		assert(isinstance(scalar, int))
+		assert(scalar >= 0)
+		assert(w >= 2)
+
+		curve = self.curve
+		add = curve.point_addition
+
+		# Odd multiples P, 3P, 5P, ..., (2^(w - 1) - 1)P. With m entries so
+		# far, adding 2m * P to each of them yields the next m entries. Those
+		# additions are independent, so every round is a single batch which
+		# also doubles 2m * P for the next round.
+		size = 1 << (w - 2)
+		table = [ self ]
+		step = add(self, self)
+		while len(table) < size:
+			pairs = [ (point, step) for point in table ]
+			if 2 * len(table) < size:
+				pairs.append((step, step))
+			sums = self.batch_add(pairs)
+			if 2 * len(table) < size:
+				step = sums.pop()
+			table += sums
+
+		# Recode the scalar into w-NAF, least significant digit first
+		(window, half) = (1 << w, 1 << (w - 1))
+		digits = [ ]
+		while scalar > 0:
+			if scalar & 1:
+				digit = scalar & (window - 1)
+				if digit >= half:
+					digit -= window
+				scalar -= digit
+			else:
+				digit = 0
+			digits.append(digit)
+			scalar >>= 1
+
+		result = curve.neutral()
+		for digit in reversed(digits):
+			result = add(result, result)
+			if digit > 0:
+				result = add(result, table[digit >> 1])
+			elif digit < 0:
+				point = table[-digit >> 1]
+				result = add(result, point if point.is_neutral else -point)
+		return result
+
+	def mul_fixed_base(self, scalar):
+		"""Returns the scalar point multiplication using the table of
+		doublings of this point that the curve keeps (see
+		EllipticCurve.fixed_base_table). After the first call, multiplying the
+		same point again only needs the additions for the set bits of the
+		scalar."""
+		assert(isinstance(scalar, int))
+		assert(scalar >= 0)
+
+		curve = self.curve
+		add = curve.point_addition
+		result = curve.neutral()
+		for power in curve.fixed_base_table(self, scalar.bit_length()):
+			if scalar == 0:
+				break
+			if scalar & 1:
+				result = add(result, power)
+			scalar >>= 1
+		return result
+
+	@staticmethod
+	def batch_add(pairs):
+		"""Returns the list of sums P + Q for a list of (P, Q) point pairs on
+		the same curve. Depending on the curve, the independent additions may
+		share work (e.g. short Weierstrass curves need only a single modular
+		inversion for the whole batch)."""
+		pairs = list(pairs)
+		if len(pairs) == 0:
+			return [ ]
+		curve = pairs[0][0].curve
+		assert(all((P.curve is curve) and (Q.curve is curve) for (P, Q) in pairs))
+		return curve.point_addition_batch(pairs)
+
 	def __eq__(self, other):
+		if self is other:
+			return True
 		return (self.x, self.y) == (other.x, other.y)
 
 	def __ne__(self, other):
 		return not (self == other)
 
 	def __hash__(self):
-		return hash((self.x, self.y))
+		return self._hash
 
 	def oncurve(self):
 		"""Indicates if the given point is satisfying the curve equation (i.e.
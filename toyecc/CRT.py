@@ -21,39 +21,46 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 #
 
-from .FieldElement import FieldElement
-
 class CRT():
 	"""Implements the Chinese Remainder Theorem algorithm where a number of
 	modular congruences are given that all need to be satisfied."""
 	def __init__(self):
-		self._moduli = { }
+		self._moduli = [ ]
+		self._values = [ ]
+		self._seen = set()
 
 	def add(self, value, modulus):
 		"""Adds a value that shall be returned when the result is taken modulo
 		the given modulus."""
-		assert(modulus not in self._moduli)
+		assert(modulus not in self._seen)
 		assert(isinstance(value, int))
 		assert(isinstance(modulus, int))
-		self._moduli[modulus] = value
+		self._seen.add(modulus)
+		self._moduli.append(modulus)
+		self._values.append(value)
 		return self
 
 	def solve(self):
 		"""Solve the Chinese Remainder Theorem for the given values and
 		moduli."""
-		# Calculate product of all moduli
-		product = 1
-		for modulus in self._moduli.keys():
-			product *= modulus
+		# Calculate the products of all moduli before and after each one, so
+		# that the product of all others does not need a bigint division
+		moduli = self._moduli
+		suffixes = [ 1 ] * (len(moduli) + 1)
+		for i in reversed(range(len(moduli))):
+			suffixes[i] = suffixes[i + 1] * moduli[i]
+		product = suffixes[0]
 
 		# Then determine the solution
 		solution = 0
-		for modulus in self._moduli.keys():
-			if self._moduli[modulus] == 0:
-				continue
-
-			rem_product = product // modulus
-			one_value = int(FieldElement(rem_product, modulus).inverse())
-			solution += rem_product * one_value * self._moduli[modulus]
+		prefix = 1
+		for (i, (modulus, value)) in enumerate(zip(moduli, self._values)):
+			# Zero values contribute nothing, but their modulus is still part
+			# of the prefix product of the ones that follow
+			if value != 0:
+				rem_product = prefix * suffixes[i + 1]
+				one_value = pow(rem_product % modulus, -1, modulus)
+				solution += rem_product * one_value * value
+			prefix *= modulus
 
 		return solution % product
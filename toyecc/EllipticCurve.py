@@ -36,6 +36,8 @@ class EllipticCurve(object):
 		self._p = p
 		self._n = n
 		self._h = h
+		self._fixed_base_tables = { }
+		self._neutral = None
 		if (Gx is not None) and (Gy is not None):
 			self._G = AffineCurvePoint(Gx, Gy, self)
 		else:
@@ -133,6 +135,20 @@ class EllipticCurve(object):
 		subtracted)."""
 		return self.n.bit_length() // 2
 
+	def fixed_base_table(self, P, bits):
+		"""Returns the successive doublings [ P, 2P, 4P, ... ] of the point P,
+		at least 'bits' of them. The table is built on first use and kept with
+		the curve, so repeated multiplications of the same base point (usually
+		the generator) do not need to double again."""
+		table = self._fixed_base_tables.get(P)
+		if table is None:
+			table = [ P ]
+			self._fixed_base_tables[P] = table
+			bits = max(bits, self.p.bit_length())
+		while len(table) < bits:
+			table.append(self.point_addition(table[-1], table[-1]))
+		return table
+
 	def enumerate_points(self):
 		"""Enumerates all points on the curve, including the point at infinity
 		(if the curve has such a special point)."""
@@ -151,7 +167,9 @@ class EllipticCurve(object):
 	def neutral(self):
 		"""Returns the neutral element of the curve group (for some curves,
 		this will be the point at infinity)."""
-		return AffineCurvePoint(None, None, self)
+		if self._neutral is None:
+			self._neutral = AffineCurvePoint(None, None, self)
+		return self._neutral
 
 	def is_neutral(self, P):
 		"""Checks if a given point P is the neutral element of the group."""
@@ -165,6 +183,24 @@ class EllipticCurve(object):
 		"""Returns the sum of two points P and Q on the curve."""
 		raise Exception(NotImplemented)
 
+	def point_addition_raw(self, x1, y1, x2, y2):
+		"""Returns the sum of two points given as integer coordinates (x1, y1)
+		and (x2, y2) as an integer coordinate tuple. A point at infinity is
+		represented as (None, None). Curves can override this to avoid
+		constructing intermediate point objects."""
+		P = AffineCurvePoint(x1, y1, self)
+		Q = AffineCurvePoint(x2, y2, self)
+		result = self.point_addition(P, Q)
+		if result.x is None:
+			return (None, None)
+		return (int(result.x), int(result.y))
+
+	def point_addition_batch(self, pairs):
+		"""Returns the list of sums P + Q for a list of (P, Q) point pairs.
+		Curves can override this to share work between the independent
+		additions, e.g. a single modular inversion."""
+		return [ self.point_addition(P, Q) for (P, Q) in pairs ]
+
 	def point_conjugate(self, P):
 		"""Returns the negated point -P to a given point P."""
 		raise Exception(NotImplemented)
@@ -90,21 +90,36 @@ class MontgomeryCurve(EllipticCurve):
 		if P.is_neutral:
 			# P is at infinity, O + Q = Q
 			result = Q
-		elif P == -Q:
-			# P == -Q, return O (point at infinity)
-			result = AffineCurvePoint.neutral(self)
-		elif P == Q:
-			# P == Q, point doubling
-			newx = -2 * P.x - self.a + (3 * P.x**2 + 2 * P.x * self.a + 1)**2 // (4 * P.y**2 * self.b)
-			newy = -P.y + (3 * P.x**2 + 2 * P.x * self.a + 1) * (3 * P.x + self.a) // (2 * P.y * self.b) - (3 * P.x**2 + 2 * P.x * self.a + 1)**3 // (8 * P.y**3 * self.b**2)
-			result = AffineCurvePoint(int(newx), int(newy), self)
 		else:
-			# P != Q, point addition
-			newx = -P.x - Q.x - self.a + (P.y - Q.y)**2 * self.b // (P.x - Q.x)**2
-			newy = (2 * P.x + Q.x + self.a) * (P.y - Q.y) // (P.x - Q.x) - P.y - (P.y - Q.y)**3 * self.b // (P.x - Q.x)**3
-			result = AffineCurvePoint(int(newx), int(newy), self)
+			# Work on plain integers, only the result is wrapped again
+			(x2, y2) = (None, None) if Q.is_neutral else (int(Q.x), int(Q.y))
+			result = AffineCurvePoint(*self.point_addition_raw(int(P.x), int(P.y), x2, y2), self)
 		return result
 
+	@doc_inherit(EllipticCurve)
+	def point_addition_raw(self, x1, y1, x2, y2):
+		(p, a, b) = (self.p, int(self.a), int(self.b))
+		if x1 is None:
+			# P is at infinity, O + Q = Q
+			return (x2, y2)
+		elif x2 is None:
+			# Q is at infinity, P + O = P
+			return (x1, y1)
+		elif x1 != x2:
+			# P != Q, point addition
+			s = (y1 - y2) * pow(x1 - x2, -1, p) % p
+			x = (b * s * s - a - x1 - x2) % p
+			y = ((2 * x1 + x2 + a) * s - b * s ** 3 - y1) % p
+		elif (y1 + y2) % p == 0:
+			# P == -Q, return O (point at infinity)
+			return (None, None)
+		else:
+			# P == Q, point doubling
+			s = (3 * x1 * x1 + 2 * a * x1 + 1) * pow(2 * b * y1, -1, p) % p
+			x = (b * s * s - a - 2 * x1) % p
+			y = ((3 * x1 + a) * s - b * s ** 3 - y1) % p
+		return (x, y)
+
 	def to_twistededwards(self, a = None):
 		"""Converts the domain parameters of this curve to domain parameters of
 		a birationally equivalent twisted Edwards curve.  The user may select a
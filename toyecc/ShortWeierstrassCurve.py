@@ -28,6 +28,36 @@ from .EllipticCurve import EllipticCurve
 from .DocInherit import doc_inherit
 from .CurveOps import CurveOpIsomorphism, CurveOpExportSage
 
+def _affine_add(x1, y1, x2, y2, p):
+	"""Adds the distinct affine points (x1, y1) and (x2, y2) with x1 != x2,
+	all given as integers mod p."""
+	s = (y1 - y2) * pow(x1 - x2, -1, p) % p
+	x3 = (s * s - x1 - x2) % p
+	return (x3, (s * (x1 - x3) - y1) % p)
+
+def _affine_double(x, y, a, p):
+	"""Doubles the affine point (x, y) with y != 0, all given as integers mod
+	p."""
+	s = (3 * x * x + a) * pow(2 * y, -1, p) % p
+	x3 = (s * s - 2 * x) % p
+	return (x3, (s * (x - x3) - y) % p)
+
+def _batch_inverse(values, p):
+	"""Inverts all given nonzero integers mod p with a single modular
+	inversion (Montgomery's trick): the running products are inverted once and
+	the individual inverses recovered with two multiplications each."""
+	prefixes = [ ]
+	product = 1
+	for value in values:
+		prefixes.append(product)
+		product = product * value % p
+	inverse = pow(product, -1, p)
+	inverses = [ None ] * len(values)
+	for i in reversed(range(len(values))):
+		inverses[i] = inverse * prefixes[i] % p
+		inverse = inverse * values[i] % p
+	return inverses
+
 _ShortWeierstrassCurveDomainParameters = collections.namedtuple("ShortWeierstrassCurveDomainParameters", [ "curvetype", "a", "b", "p", "n", "h", "G" ])
 
 class ShortWeierstrassCurve(EllipticCurve, CurveOpIsomorphism, CurveOpExportSage):
@@ -154,23 +184,59 @@ class ShortWeierstrassCurve(EllipticCurve, CurveOpIsomorphism, CurveOpExportSage
 		elif Q.is_neutral:
 			# Q is at infinity, P + O = P
 			result = P
-		elif P == -Q:
-			# P == -Q, return O (point at infinity)
-			result = self.neutral()
-		elif P == Q:
-			# P == Q, point doubling
-			s = ((3 * P.x ** 2) + self.a) // (2 * P.y)
-			newx = s * s - (2 * P.x)
-			newy = s * (P.x - newx) - P.y
-			result = AffineCurvePoint(int(newx), int(newy), self)
 		else:
-			# P != Q, point addition
-			s = (P.y - Q.y) // (P.x - Q.x)
-			newx = (s ** 2) - P.x - Q.x
-			newy = s * (P.x - newx) - P.y
-			result = AffineCurvePoint(int(newx), int(newy), self)
+			# Work on plain integers, only the result is wrapped again
+			result = AffineCurvePoint(*self.point_addition_raw(int(P.x), int(P.y), int(Q.x), int(Q.y)), self)
 		return result
 
+	@doc_inherit(EllipticCurve)
+	def point_addition_raw(self, x1, y1, x2, y2):
+		if x1 is None:
+			# P is at infinity, O + Q = Q
+			return (x2, y2)
+		elif x2 is None:
+			# Q is at infinity, P + O = P
+			return (x1, y1)
+		elif x1 != x2:
+			# P != Q, point addition
+			return _affine_add(x1, y1, x2, y2, self.p)
+		elif (y1 + y2) % self.p == 0:
+			# P == -Q, return O (point at infinity)
+			return (None, None)
+		else:
+			# P == Q, point doubling
+			return _affine_double(x1, y1, int(self.a), self.p)
+
+	@doc_inherit(EllipticCurve)
+	def point_addition_batch(self, pairs):
+		(p, a) = (self.p, int(self.a))
+		results = [ None ] * len(pairs)
+
+		# Sort out the trivial cases and collect the slope numerators and
+		# denominators of all others, so that they share one inversion
+		pending = [ ]
+		for (i, (P, Q)) in enumerate(pairs):
+			if P.is_neutral:
+				results[i] = Q
+			elif Q.is_neutral:
+				results[i] = P
+			else:
+				(x1, y1, x2, y2) = (int(P.x), int(P.y), int(Q.x), int(Q.y))
+				if x1 != x2:
+					pending.append((i, x1, y1, x2, y1 - y2, x1 - x2))
+				elif (y1 + y2) % p == 0:
+					results[i] = self.neutral()
+				else:
+					pending.append((i, x1, y1, x1, 3 * x1 * x1 + a, 2 * y1))
+
+		if len(pending) > 0:
+			inverses = _batch_inverse([ denominator for (i, x1, y1, x2, numerator, denominator) in pending ], p)
+			for ((i, x1, y1, x2, numerator, denominator), inverse) in zip(pending, inverses):
+				s = numerator * inverse % p
+				x3 = (s * s - x1 - x2) % p
+				results[i] = AffineCurvePoint(x3, (s * (x1 - x3) - y1) % p, self)
+		return results
+
 	@doc_inherit(EllipticCurve)
 	def compress(self, P):
 		return (int(P.x), int(P.y) % 2)
@@ -92,7 +92,9 @@ class TwistedEdwardsCurve(EllipticCurve):
 
 	@doc_inherit(EllipticCurve)
 	def neutral(self):
-		return AffineCurvePoint(0, 1, self)
+		if self._neutral is None:
+			self._neutral = AffineCurvePoint(0, 1, self)
+		return self._neutral
 
 	@doc_inherit(EllipticCurve)
 	def is_neutral(self, P):
@@ -108,9 +110,15 @@ class TwistedEdwardsCurve(EllipticCurve):
 
 	@doc_inherit(EllipticCurve)
 	def point_addition(self, P, Q):
-		x = (P.x * Q.y + Q.x * P.y) // (1 + self.d * P.x * Q.x * P.y * Q.y)
-		y = (P.y * Q.y - self.a * P.x * Q.x) // (1 - self.d * P.x * Q.x * P.y * Q.y)
-		return AffineCurvePoint(int(x), int(y), self)
+		return AffineCurvePoint(*self.point_addition_raw(int(P.x), int(P.y), int(Q.x), int(Q.y)), self)
+
+	@doc_inherit(EllipticCurve)
+	def point_addition_raw(self, x1, y1, x2, y2):
+		p = self.p
+		t = int(self.d) * x1 * x2 * y1 * y2
+		x = (x1 * y2 + x2 * y1) * pow(1 + t, -1, p) % p
+		y = (y1 * y2 - int(self.a) * x1 * x2) * pow(1 - t, -1, p) % p
+		return (x, y)
 
 	def to_montgomery(self, b = None):
 		"""Converts the twisted Edwards curve domain parameters to Montgomery